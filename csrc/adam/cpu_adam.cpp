@@ -1,127 +1,182 @@
 #include "cpu_adam.h"
-#include <cuda_runtime_api.h>
 #include <math.h>
 #include <omp.h>
+#include <pthread.h>
+#include <sched.h>
+#if defined(__SVE__)
+#include <sys/auxv.h>
+#endif
 #include <torch/extension.h>
 #include <iostream>
 #include <memory>
+#include <string>
 #include <type_traits>
 #include <unordered_map>
-#include "cublas_v2.h"
-#include "cuda.h"
-#include "curand.h"
-#include "custom_cuda_layers.h"
+#include <vector>
 
 static std::unordered_map<int, std::shared_ptr<void>> s_optimizers;
 
 #define ROUND_DOWN(size, step) ((size) & ~((step)-1))
 
+// Tensors below this many elements are too small to keep every thread busy on
+// their own, so the multi-tensor update spreads them across one thread team.
+#define MULTI_TENSOR_THRESHOLD (1 << 16)
+
 // C++ interface
 
-void Adam_Optimizer::Step(float* _params,
-                          float* grads,
-                          float* _exp_avg,
-                          float* _exp_avg_sq,
-                          size_t _param_size,
-                          __half* dev_params)
+// Vectorized update over the largest multiple of SPAN vectors in the tensor;
+// returns the number of elements it covered. Every stage is issued for all
+// SPAN vectors before the next one, so the independent chains overlap the
+// latency of the sqrt and div units. The loops over SPAN are unrolled by the
+// compiler since SPAN is a constant.
+template <int SPAN, bool WeightDecay, typename StateT>
+size_t Adam_Optimizer::Step_AVX(float* _params,
+                                float* grads,
+                                StateT* _exp_avg,
+                                float* _exp_avg_sq,
+                                size_t _param_size,
+                                __half* dev_params)
 {
-    float betta1_minus1 = 1 - _betta1;
-    float betta2_minus1 = 1 - _betta2;
-
-    float bias_correction1 = 1 - _betta1_t;
-    float bias_correction2 = 1 / sqrt(1 - _betta2_t);
-
-    float step_size = -1 * _alpha / bias_correction1;
-
     size_t rounded_size = 0;
 
-#if defined(__AVX512__) or defined(__AVX256__)
+#if defined(SIMD_WIDTH)
 
     AVX_Data betta1_4;
     betta1_4.data = SIMD_SET(_betta1);
     AVX_Data betta2_4;
     betta2_4.data = SIMD_SET(_betta2);
 
+    float betta1_minus1 = 1 - _betta1;
+    float betta2_minus1 = 1 - _betta2;
     AVX_Data betta1_minus1_4;
     betta1_minus1_4.data = SIMD_SET(betta1_minus1);
     AVX_Data betta2_minus1_4;
     betta2_minus1_4.data = SIMD_SET(betta2_minus1);
 
     AVX_Data bias2_sqrt;
-    bias2_sqrt.data = SIMD_SET(bias_correction2);
+    bias2_sqrt.data = SIMD_SET(_bias_correction2);
 
     AVX_Data eps_4;
     eps_4.data = SIMD_SET(_eps);
 
     AVX_Data step_size_4;
-    step_size_4.data = SIMD_SET(step_size);
+    step_size_4.data = SIMD_SET(_step_size);
 
     AVX_Data weight_decay4;
-    if (_weight_decay > 0) weight_decay4.data = SIMD_SET(_weight_decay);
+    if (WeightDecay) weight_decay4.data = SIMD_SET(_weight_decay);
 
-    rounded_size = ROUND_DOWN(_param_size, SIMD_WIDTH);
+    rounded_size = ROUND_DOWN(_param_size, SIMD_WIDTH * SPAN);
 
     for (size_t t = 0; t < rounded_size; t += TILE) {
         size_t copy_size = TILE;
         if ((t + TILE) > rounded_size) copy_size = rounded_size - t;
         size_t offset = copy_size + t;
-#pragma omp parallel for
-        for (size_t i = t; i < offset; i += SIMD_WIDTH) {
-            AVX_Data grad_4;
-            grad_4.data = SIMD_LOAD(grads + i);
+        if (dev_params) WaitParamsBuffer();
+#pragma omp parallel for schedule(static) num_threads(_num_threads)
+        for (size_t i = t; i < offset; i += SIMD_WIDTH * SPAN) {
+            // The hardware streamer stops at page boundaries, so each thread
+            // requests its next page of every stream into L2 ahead of time.
+            // Only the widest span walks the bulk of a tensor.
+            if (SPAN == 8) {
+                for (size_t l = 0; l < SIMD_WIDTH * SPAN; l += CACHE_LINE_FLOATS) {
+                    SIMD_PREFETCH(grads + i + l + PREFETCH_DISTANCE);
+                    SIMD_PREFETCH(_exp_avg + i + l + PREFETCH_DISTANCE);
+                    SIMD_PREFETCH(_exp_avg_sq + i + l + PREFETCH_DISTANCE);
+                    SIMD_PREFETCH(_params + i + l + PREFETCH_DISTANCE);
+                }
+            }
 
-            AVX_Data momentum_4;
-            momentum_4.data = SIMD_LOAD(_exp_avg + i);
-            AVX_Data variance_4;
-            variance_4.data = SIMD_LOAD(_exp_avg_sq + i);
+            AVX_Data grad_4[SPAN];
+            for (int j = 0; j < SPAN; j++) grad_4[j].data = SIMD_LOAD(grads + i + SIMD_WIDTH * j);
 
-            AVX_Data param_4;
-            param_4.data = SIMD_LOAD(_params + i);
+            AVX_Data momentum_4[SPAN];
+            for (int j = 0; j < SPAN; j++)
+                momentum_4[j].data = simd_load_state(_exp_avg + i + SIMD_WIDTH * j);
 
-            if (_weight_decay > 0)
-                grad_4.data = SIMD_FMA(param_4.data, weight_decay4.data, grad_4.data);
+            AVX_Data variance_4[SPAN];
+            for (int j = 0; j < SPAN; j++)
+                variance_4[j].data = simd_load_state(_exp_avg_sq + i + SIMD_WIDTH * j);
 
-            momentum_4.data = SIMD_MUL(momentum_4.data, betta1_4.data);
-            momentum_4.data = SIMD_FMA(grad_4.data, betta1_minus1_4.data, momentum_4.data);
+            AVX_Data param_4[SPAN];
+            for (int j = 0; j < SPAN; j++)
+                param_4[j].data = SIMD_LOAD(_params + i + SIMD_WIDTH * j);
 
-            variance_4.data = SIMD_MUL(variance_4.data, betta2_4.data);
-            grad_4.data = SIMD_MUL(grad_4.data, grad_4.data);
-            variance_4.data = SIMD_FMA(grad_4.data, betta2_minus1_4.data, variance_4.data);
+            if (WeightDecay) {
+                for (int j = 0; j < SPAN; j++)
+                    grad_4[j].data = SIMD_FMA(param_4[j].data, weight_decay4.data, grad_4[j].data);
+            }
+
+            for (int j = 0; j < SPAN; j++) {
+                momentum_4[j].data = SIMD_MUL(momentum_4[j].data, betta1_4.data);
+                momentum_4[j].data =
+                    SIMD_FMA(grad_4[j].data, betta1_minus1_4.data, momentum_4[j].data);
+            }
 
-            grad_4.data = SIMD_SQRT(variance_4.data);
-            grad_4.data = SIMD_FMA(grad_4.data, bias2_sqrt.data, eps_4.data);
-            grad_4.data = SIMD_DIV(momentum_4.data, grad_4.data);
+            for (int j = 0; j < SPAN; j++)
+                variance_4[j].data = SIMD_MUL(variance_4[j].data, betta2_4.data);
+            for (int j = 0; j < SPAN; j++)
+                grad_4[j].data = SIMD_MUL(grad_4[j].data, grad_4[j].data);
+            for (int j = 0; j < SPAN; j++)
+                variance_4[j].data =
+                    SIMD_FMA(grad_4[j].data, betta2_minus1_4.data, variance_4[j].data);
 
-            param_4.data = SIMD_FMA(grad_4.data, step_size_4.data, param_4.data);
+            for (int j = 0; j < SPAN; j++) grad_4[j].data = SIMD_SQRT(variance_4[j].data);
 
-            SIMD_STORE(_params + i, param_4.data);
+            for (int j = 0; j < SPAN; j++)
+                grad_4[j].data = SIMD_FMA(grad_4[j].data, bias2_sqrt.data, eps_4.data);
+            for (int j = 0; j < SPAN; j++)
+                grad_4[j].data = SIMD_DIV(momentum_4[j].data, grad_4[j].data);
 
-            if (dev_params) SIMD_STORE(_doubled_buffer[_buf_index] + (i - t), param_4.data);
+            for (int j = 0; j < SPAN; j++)
+                param_4[j].data = SIMD_FMA(grad_4[j].data, step_size_4.data, param_4[j].data);
 
-            SIMD_STORE(_exp_avg + i, momentum_4.data);
-            SIMD_STORE(_exp_avg_sq + i, variance_4.data);
-        }
-        if (dev_params) {
-            launch_param_update(_doubled_buffer[_buf_index],
-                                dev_params + t,
-                                copy_size,
-                                Context::Instance().GetCurrentStream());
-            _buf_index = !_buf_index;
+            for (int j = 0; j < SPAN; j++)
+                SIMD_STORE(_params + i + SIMD_WIDTH * j, param_4[j].data);
+
+            if (dev_params) {
+                for (int j = 0; j < SPAN; j++)
+                    SIMD_STORE_HALF(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH * j,
+                                    param_4[j].data);
+            }
+
+            for (int j = 0; j < SPAN; j++)
+                simd_store_state(_exp_avg + i + SIMD_WIDTH * j, momentum_4[j].data);
+            for (int j = 0; j < SPAN; j++)
+                simd_store_state(_exp_avg_sq + i + SIMD_WIDTH * j, variance_4[j].data);
         }
+        if (dev_params) CopyParams(dev_params + t, copy_size);
     }
 
 #endif
 
+    return rounded_size;
+}
+
+template <bool WeightDecay, typename StateT>
+void Adam_Optimizer::Step(float* _params,
+                          float* grads,
+                          StateT* _exp_avg,
+                          float* _exp_avg_sq,
+                          size_t _param_size,
+                          __half* dev_params)
+{
+    float betta1_minus1 = 1 - _betta1;
+    float betta2_minus1 = 1 - _betta2;
+
+    size_t rounded_size =
+        Step_AVX<1, WeightDecay>(_params, grads, _exp_avg, _exp_avg_sq, _param_size, dev_params);
+
     if (_param_size > rounded_size) {
-#pragma omp parallel for
+        if (dev_params) WaitParamsBuffer();
+#pragma omp parallel for schedule(static) num_threads(_num_threads)
         for (size_t k = rounded_size; k < _param_size; k++) {
             float grad = grads[k];
             float param = _params[k];
-            float momentum = _exp_avg[k];
-            float variance = _exp_avg_sq[k];
-            if (_weight_decay > 0) grad = param * _weight_decay + grad;
+            float momentum = load_state(_exp_avg + k);
+            float variance = load_state(_exp_avg_sq + k);
+            if (WeightDecay) grad = param * _weight_decay + grad;
 
-            momentum *= momentum * _betta1;
+            momentum = momentum * _betta1;
             momentum = grad * betta1_minus1 + momentum;
 
             variance = variance * _betta2;
@@ -129,193 +184,61 @@ void Adam_Optimizer::Step(float* _params,
             variance = grad * betta2_minus1 + variance;
 
             grad = sqrt(variance);
-            grad = grad * bias_correction2 + _eps;
+            grad = grad * _bias_correction2 + _eps;
             grad = momentum / grad;
 
-            param = grad * step_size + param;
+            param = grad * _step_size + param;
             if (dev_params) _doubled_buffer[_buf_index][k - rounded_size] = (__half)param;
 
             _params[k] = param;
-            _exp_avg[k] = momentum;
-            _exp_avg_sq[k] = variance;
-        }
-        if (dev_params) {
-            launch_param_update(_doubled_buffer[_buf_index],
-                                dev_params + rounded_size,
-                                (_param_size - rounded_size),
-                                Context::Instance().GetCurrentStream());
+            store_state(_exp_avg + k, momentum);
+            store_state(_exp_avg_sq + k, variance);
         }
+        if (dev_params) CopyParams(dev_params + rounded_size, _param_size - rounded_size);
     }
 }
 
+template <bool WeightDecay, typename StateT>
 void Adam_Optimizer::Step_4(float* _params,
                             float* grads,
-                            float* _exp_avg,
+                            StateT* _exp_avg,
                             float* _exp_avg_sq,
                             size_t _param_size,
                             __half* dev_params)
 {
-    size_t rounded_size = 0;
-
-#if defined(__AVX512__) or defined(__AVX256__)
-
-    AVX_Data betta1_4;
-    betta1_4.data = SIMD_SET(_betta1);
-    AVX_Data betta2_4;
-    betta2_4.data = SIMD_SET(_betta2);
-
-    float betta1_minus1 = 1 - _betta1;
-    float betta2_minus1 = 1 - _betta2;
-    AVX_Data betta1_minus1_4;
-    betta1_minus1_4.data = SIMD_SET(betta1_minus1);
-    AVX_Data betta2_minus1_4;
-    betta2_minus1_4.data = SIMD_SET(betta2_minus1);
-
-    float bias_correction1 = 1 - _betta1_t;
-    float bias_correction2 = 1 / sqrt(1 - _betta2_t);
-    // AVX_Data bias_correction1_4 = SIMD_SET(bias_correction1);
-    AVX_Data bias2_sqrt;
-    bias2_sqrt.data = SIMD_SET(bias_correction2);
-
-    AVX_Data eps_4;
-    eps_4.data = SIMD_SET(_eps);
-
-    float step_size = -1 * _alpha / bias_correction1;
-    AVX_Data step_size_4;
-    step_size_4.data = SIMD_SET(step_size);
-
-    rounded_size = ROUND_DOWN(_param_size, (SIMD_WIDTH << 2));
-
-    for (size_t t = 0; t < rounded_size; t += TILE) {
-        size_t copy_size = TILE;
-        if ((t + TILE) > rounded_size) copy_size = rounded_size - t;
-        size_t offset = copy_size + t;
-#pragma omp parallel for
-        for (size_t i = t; i < offset; i += (SIMD_WIDTH << 2)) {
-            AVX_Data grad_4[4];
-            grad_4[0].data = SIMD_LOAD(grads + i);
-            grad_4[1].data = SIMD_LOAD(grads + i + SIMD_WIDTH);
-            grad_4[2].data = SIMD_LOAD(grads + i + (SIMD_WIDTH << 1));
-            grad_4[3].data = SIMD_LOAD(grads + i + SIMD_WIDTH * 3);
-
-            AVX_Data momentum_4[4];
-            momentum_4[0].data = SIMD_LOAD(_exp_avg + i);
-            momentum_4[1].data = SIMD_LOAD(_exp_avg + i + SIMD_WIDTH);
-            momentum_4[2].data = SIMD_LOAD(_exp_avg + i + (SIMD_WIDTH << 1));
-            momentum_4[3].data = SIMD_LOAD(_exp_avg + i + SIMD_WIDTH * 3);
-
-            AVX_Data variance_4[4];
-            variance_4[0].data = SIMD_LOAD(_exp_avg_sq + i);
-            variance_4[1].data = SIMD_LOAD(_exp_avg_sq + i + SIMD_WIDTH);
-            variance_4[2].data = SIMD_LOAD(_exp_avg_sq + i + (SIMD_WIDTH << 1));
-            variance_4[3].data = SIMD_LOAD(_exp_avg_sq + i + SIMD_WIDTH * 3);
-
-            AVX_Data param_4[4];
-            param_4[0].data = SIMD_LOAD(_params + i);
-            param_4[1].data = SIMD_LOAD(_params + i + SIMD_WIDTH);
-            param_4[2].data = SIMD_LOAD(_params + i + (SIMD_WIDTH << 1));
-            param_4[3].data = SIMD_LOAD(_params + i + SIMD_WIDTH * 3);
-
-            if (_weight_decay > 0) {
-                AVX_Data weight_decay4;
-                weight_decay4.data = SIMD_SET(_weight_decay);
-                grad_4[0].data = SIMD_FMA(param_4[0].data, weight_decay4.data, grad_4[0].data);
-                grad_4[1].data = SIMD_FMA(param_4[1].data, weight_decay4.data, grad_4[1].data);
-                grad_4[2].data = SIMD_FMA(param_4[2].data, weight_decay4.data, grad_4[2].data);
-                grad_4[3].data = SIMD_FMA(param_4[3].data, weight_decay4.data, grad_4[3].data);
-            }
-
-            momentum_4[0].data = SIMD_MUL(momentum_4[0].data, betta1_4.data);
-            momentum_4[0].data = SIMD_FMA(grad_4[0].data, betta1_minus1_4.data, momentum_4[0].data);
-            momentum_4[1].data = SIMD_MUL(momentum_4[1].data, betta1_4.data);
-            momentum_4[1].data = SIMD_FMA(grad_4[1].data, betta1_minus1_4.data, momentum_4[1].data);
-            momentum_4[2].data = SIMD_MUL(momentum_4[2].data, betta1_4.data);
-            momentum_4[2].data = SIMD_FMA(grad_4[2].data, betta1_minus1_4.data, momentum_4[2].data);
-            momentum_4[3].data = SIMD_MUL(momentum_4[3].data, betta1_4.data);
-            momentum_4[3].data = SIMD_FMA(grad_4[3].data, betta1_minus1_4.data, momentum_4[3].data);
-
-            variance_4[0].data = SIMD_MUL(variance_4[0].data, betta2_4.data);
-            variance_4[1].data = SIMD_MUL(variance_4[1].data, betta2_4.data);
-            variance_4[2].data = SIMD_MUL(variance_4[2].data, betta2_4.data);
-            variance_4[3].data = SIMD_MUL(variance_4[3].data, betta2_4.data);
-            grad_4[0].data = SIMD_MUL(grad_4[0].data, grad_4[0].data);
-            grad_4[1].data = SIMD_MUL(grad_4[1].data, grad_4[1].data);
-            grad_4[2].data = SIMD_MUL(grad_4[2].data, grad_4[2].data);
-            grad_4[3].data = SIMD_MUL(grad_4[3].data, grad_4[3].data);
-            variance_4[0].data = SIMD_FMA(grad_4[0].data, betta2_minus1_4.data, variance_4[0].data);
-            variance_4[1].data = SIMD_FMA(grad_4[1].data, betta2_minus1_4.data, variance_4[1].data);
-            variance_4[2].data = SIMD_FMA(grad_4[2].data, betta2_minus1_4.data, variance_4[2].data);
-            variance_4[3].data = SIMD_FMA(grad_4[3].data, betta2_minus1_4.data, variance_4[3].data);
-
-            grad_4[0].data = SIMD_SQRT(variance_4[0].data);
-            grad_4[1].data = SIMD_SQRT(variance_4[1].data);
-            grad_4[2].data = SIMD_SQRT(variance_4[2].data);
-            grad_4[3].data = SIMD_SQRT(variance_4[3].data);
-
-            grad_4[0].data = SIMD_FMA(grad_4[0].data, bias2_sqrt.data, eps_4.data);
-            grad_4[1].data = SIMD_FMA(grad_4[1].data, bias2_sqrt.data, eps_4.data);
-            grad_4[2].data = SIMD_FMA(grad_4[2].data, bias2_sqrt.data, eps_4.data);
-            grad_4[3].data = SIMD_FMA(grad_4[3].data, bias2_sqrt.data, eps_4.data);
-            grad_4[0].data = SIMD_DIV(momentum_4[0].data, grad_4[0].data);
-            grad_4[1].data = SIMD_DIV(momentum_4[1].data, grad_4[1].data);
-            grad_4[2].data = SIMD_DIV(momentum_4[2].data, grad_4[2].data);
-            grad_4[3].data = SIMD_DIV(momentum_4[3].data, grad_4[3].data);
-
-            param_4[0].data = SIMD_FMA(grad_4[0].data, step_size_4.data, param_4[0].data);
-            param_4[1].data = SIMD_FMA(grad_4[1].data, step_size_4.data, param_4[1].data);
-            param_4[2].data = SIMD_FMA(grad_4[2].data, step_size_4.data, param_4[2].data);
-            param_4[3].data = SIMD_FMA(grad_4[3].data, step_size_4.data, param_4[3].data);
-
-            SIMD_STORE(_params + i, param_4[0].data);
-            SIMD_STORE(_params + i + SIMD_WIDTH, param_4[1].data);
-            SIMD_STORE(_params + i + (SIMD_WIDTH << 1), param_4[2].data);
-            SIMD_STORE(_params + i + SIMD_WIDTH * 3, param_4[3].data);
-
-            if (dev_params) {
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t), param_4[0].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH, param_4[1].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + (SIMD_WIDTH << 1),
-                           param_4[2].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH * 3, param_4[3].data);
-            }
-
-            SIMD_STORE(_exp_avg + i, momentum_4[0].data);
-            SIMD_STORE(_exp_avg + i + SIMD_WIDTH, momentum_4[1].data);
-            SIMD_STORE(_exp_avg + i + (SIMD_WIDTH << 1), momentum_4[2].data);
-            SIMD_STORE(_exp_avg + i + SIMD_WIDTH * 3, momentum_4[3].data);
-
-            SIMD_STORE(_exp_avg_sq + i, variance_4[0].data);
-            SIMD_STORE(_exp_avg_sq + i + SIMD_WIDTH, variance_4[1].data);
-            SIMD_STORE(_exp_avg_sq + i + (SIMD_WIDTH << 1), variance_4[2].data);
-            SIMD_STORE(_exp_avg_sq + i + SIMD_WIDTH * 3, variance_4[3].data);
-        }
-
-        if (dev_params) {
-            launch_param_update(_doubled_buffer[_buf_index],
-                                dev_params + t,
-                                copy_size,
-                                Context::Instance().GetCurrentStream());
-            _buf_index = !_buf_index;
-        }
-    }
-#endif
+    size_t rounded_size =
+        Step_AVX<4, WeightDecay>(_params, grads, _exp_avg, _exp_avg_sq, _param_size, dev_params);
     if (_param_size > rounded_size)
-        Step((_params + rounded_size),
-             (grads + rounded_size),
-             (_exp_avg + rounded_size),
-             (_exp_avg_sq + rounded_size),
-             (_param_size - rounded_size),
-             (dev_params != nullptr ? (dev_params + rounded_size) : dev_params));
+        Step<WeightDecay>((_params + rounded_size),
+                          (grads + rounded_size),
+                          (_exp_avg + rounded_size),
+                          (_exp_avg_sq + rounded_size),
+                          (_param_size - rounded_size),
+                          (dev_params != nullptr ? (dev_params + rounded_size) : dev_params));
 }
 
-int create_adam_optimizer(int optimizer_id,
-                          float alpha = 1e-3,
-                          float betta1 = 0.9,
-                          float betta2 = 0.999,
-                          float eps = 1e-8,
-                          float weight_decay = 0)
+int create_adam_optimizer(int optimizer_id, int num_threads = 0)
 {
-    auto opt = std::make_shared<Adam_Optimizer>(alpha, betta1, betta2, eps, weight_decay);
+    // The op is compiled for a fixed ISA level at install time; fail here rather
+    // than with SIGILL inside the first step when it is loaded on an older CPU.
+#if defined(__AVX512__)
+    // -march=skylake-avx512 lets the compiler use the BW, DQ and VL extensions
+    // anywhere in the op, not just the F subset the SIMD macros ask for
+    AT_ASSERTM(__builtin_cpu_supports("avx512f") && __builtin_cpu_supports("avx512bw") &&
+                   __builtin_cpu_supports("avx512dq") && __builtin_cpu_supports("avx512vl"),
+               "cpu_adam_op was built for AVX-512, which this CPU does not support");
+#else
+#if defined(__AVX256__)
+    AT_ASSERTM(__builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma"),
+               "cpu_adam_op was built for AVX2, which this CPU does not support");
+#else
+#if defined(__SVE__)
+    AT_ASSERTM((getauxval(AT_HWCAP) & HWCAP_SVE) && svcntw() == SIMD_WIDTH,
+               "cpu_adam_op was built for SVE with a different vector length than this CPU's");
+#endif
+#endif
+#endif
+    auto opt = std::make_shared<Adam_Optimizer>(num_threads);
 
     s_optimizers[optimizer_id] = opt;
 #if defined(__AVX512__)
@@ -325,247 +248,72 @@ int create_adam_optimizer(int optimizer_id,
 #if defined(__AVX256__)
     std::cout << "Adam Optimizer #" << optimizer_id
               << " is created with AVX2 arithmetic capability." << std::endl;
+#else
+#if defined(__SVE__)
+    std::cout << "Adam Optimizer #" << optimizer_id << " is created with SVE ("
+              << __ARM_FEATURE_SVE_BITS << "-bit) arithmetic capability." << std::endl;
 #else
     std::cout << "Adam Optimizer #" << optimizer_id
               << " is created with scalar arithmetic capability." << std::endl;
 #endif
+#endif
 #endif
     return 0;
 }
 
+template <bool WeightDecay, typename StateT>
 void Adam_Optimizer::Step_8(float* _params,
                             float* grads,
-                            float* _exp_avg,
+                            StateT* _exp_avg,
                             float* _exp_avg_sq,
                             size_t _param_size,
                             __half* dev_params)
 {
-    size_t rounded_size = 0;
-
-#if defined(__AVX512__) or defined(__AVX256__)
-
-    AVX_Data betta1_4;
-    betta1_4.data = SIMD_SET(_betta1);
-    AVX_Data betta2_4;
-    betta2_4.data = SIMD_SET(_betta2);
-
-    float betta1_minus1 = 1 - _betta1;
-    float betta2_minus1 = 1 - _betta2;
-    AVX_Data betta1_minus1_4;
-    betta1_minus1_4.data = SIMD_SET(betta1_minus1);
-    AVX_Data betta2_minus1_4;
-    betta2_minus1_4.data = SIMD_SET(betta2_minus1);
-
-    float bias_correction1 = 1 - _betta1_t;
-    float bias_correction2 = 1 / sqrt(1 - _betta2_t);
-    // AVX_Data bias_correction1_4 = SIMD_SET(bias_correction1);
-    AVX_Data bias2_sqrt;
-    bias2_sqrt.data = SIMD_SET(bias_correction2);
-
-    AVX_Data eps_4;
-    eps_4.data = SIMD_SET(_eps);
-
-    float step_size = -1 * _alpha / bias_correction1;
-    AVX_Data step_size_4;
-    step_size_4.data = SIMD_SET(step_size);
-
-    rounded_size = ROUND_DOWN(_param_size, (SIMD_WIDTH << 3));
-
-    for (size_t t = 0; t < rounded_size; t += TILE) {
-        size_t copy_size = TILE;
-        if ((t + TILE) > rounded_size) copy_size = rounded_size - t;
-        size_t offset = copy_size + t;
-#pragma omp parallel for
-        for (size_t i = t; i < offset; i += (SIMD_WIDTH << 3)) {
-            AVX_Data grad_4[8];
-            grad_4[0].data = SIMD_LOAD(grads + i);
-            grad_4[1].data = SIMD_LOAD(grads + i + SIMD_WIDTH);
-            grad_4[2].data = SIMD_LOAD(grads + i + (SIMD_WIDTH << 1));
-            grad_4[3].data = SIMD_LOAD(grads + i + SIMD_WIDTH * 3);
-            grad_4[4].data = SIMD_LOAD(grads + i + (SIMD_WIDTH << 2));
-            grad_4[5].data = SIMD_LOAD(grads + i + SIMD_WIDTH * 5);
-            grad_4[6].data = SIMD_LOAD(grads + i + SIMD_WIDTH * 6);
-            grad_4[7].data = SIMD_LOAD(grads + i + SIMD_WIDTH * 7);
-
-            AVX_Data momentum_4[8];
-            momentum_4[0].data = SIMD_LOAD(_exp_avg + i);
-            momentum_4[1].data = SIMD_LOAD(_exp_avg + i + SIMD_WIDTH);
-            momentum_4[2].data = SIMD_LOAD(_exp_avg + i + (SIMD_WIDTH << 1));
-            momentum_4[3].data = SIMD_LOAD(_exp_avg + i + SIMD_WIDTH * 3);
-            momentum_4[4].data = SIMD_LOAD(_exp_avg + i + (SIMD_WIDTH << 2));
-            momentum_4[5].data = SIMD_LOAD(_exp_avg + i + SIMD_WIDTH * 5);
-            momentum_4[6].data = SIMD_LOAD(_exp_avg + i + SIMD_WIDTH * 6);
-            momentum_4[7].data = SIMD_LOAD(_exp_avg + i + SIMD_WIDTH * 7);
-
-            AVX_Data variance_4[8];
-            variance_4[0].data = SIMD_LOAD(_exp_avg_sq + i);
-            variance_4[1].data = SIMD_LOAD(_exp_avg_sq + i + SIMD_WIDTH);
-            variance_4[2].data = SIMD_LOAD(_exp_avg_sq + i + (SIMD_WIDTH << 1));
-            variance_4[3].data = SIMD_LOAD(_exp_avg_sq + i + SIMD_WIDTH * 3);
-            variance_4[4].data = SIMD_LOAD(_exp_avg_sq + i + (SIMD_WIDTH << 2));
-            variance_4[5].data = SIMD_LOAD(_exp_avg_sq + i + SIMD_WIDTH * 5);
-            variance_4[6].data = SIMD_LOAD(_exp_avg_sq + i + SIMD_WIDTH * 6);
-            variance_4[7].data = SIMD_LOAD(_exp_avg_sq + i + SIMD_WIDTH * 7);
-
-            AVX_Data param_4[8];
-            param_4[0].data = SIMD_LOAD(_params + i);
-            param_4[1].data = SIMD_LOAD(_params + i + SIMD_WIDTH);
-            param_4[2].data = SIMD_LOAD(_params + i + (SIMD_WIDTH << 1));
-            param_4[3].data = SIMD_LOAD(_params + i + SIMD_WIDTH * 3);
-            param_4[4].data = SIMD_LOAD(_params + i + (SIMD_WIDTH << 2));
-            param_4[5].data = SIMD_LOAD(_params + i + SIMD_WIDTH * 5);
-            param_4[6].data = SIMD_LOAD(_params + i + SIMD_WIDTH * 6);
-            param_4[7].data = SIMD_LOAD(_params + i + SIMD_WIDTH * 7);
-
-            if (_weight_decay > 0) {
-                AVX_Data weight_decay4;
-                weight_decay4.data = SIMD_SET(_weight_decay);
-                grad_4[0].data = SIMD_FMA(param_4[0].data, weight_decay4.data, grad_4[0].data);
-                grad_4[1].data = SIMD_FMA(param_4[1].data, weight_decay4.data, grad_4[1].data);
-                grad_4[2].data = SIMD_FMA(param_4[2].data, weight_decay4.data, grad_4[2].data);
-                grad_4[3].data = SIMD_FMA(param_4[3].data, weight_decay4.data, grad_4[3].data);
-                grad_4[4].data = SIMD_FMA(param_4[4].data, weight_decay4.data, grad_4[4].data);
-                grad_4[5].data = SIMD_FMA(param_4[5].data, weight_decay4.data, grad_4[5].data);
-                grad_4[6].data = SIMD_FMA(param_4[6].data, weight_decay4.data, grad_4[6].data);
-                grad_4[7].data = SIMD_FMA(param_4[7].data, weight_decay4.data, grad_4[7].data);
-            }
-
-            momentum_4[0].data = SIMD_MUL(momentum_4[0].data, betta1_4.data);
-            momentum_4[0].data = SIMD_FMA(grad_4[0].data, betta1_minus1_4.data, momentum_4[0].data);
-            momentum_4[1].data = SIMD_MUL(momentum_4[1].data, betta1_4.data);
-            momentum_4[1].data = SIMD_FMA(grad_4[1].data, betta1_minus1_4.data, momentum_4[1].data);
-            momentum_4[2].data = SIMD_MUL(momentum_4[2].data, betta1_4.data);
-            momentum_4[2].data = SIMD_FMA(grad_4[2].data, betta1_minus1_4.data, momentum_4[2].data);
-            momentum_4[3].data = SIMD_MUL(momentum_4[3].data, betta1_4.data);
-            momentum_4[3].data = SIMD_FMA(grad_4[3].data, betta1_minus1_4.data, momentum_4[3].data);
-            momentum_4[4].data = SIMD_MUL(momentum_4[4].data, betta1_4.data);
-            momentum_4[4].data = SIMD_FMA(grad_4[4].data, betta1_minus1_4.data, momentum_4[4].data);
-            momentum_4[5].data = SIMD_MUL(momentum_4[5].data, betta1_4.data);
-            momentum_4[5].data = SIMD_FMA(grad_4[5].data, betta1_minus1_4.data, momentum_4[5].data);
-            momentum_4[6].data = SIMD_MUL(momentum_4[6].data, betta1_4.data);
-            momentum_4[6].data = SIMD_FMA(grad_4[6].data, betta1_minus1_4.data, momentum_4[6].data);
-            momentum_4[7].data = SIMD_MUL(momentum_4[7].data, betta1_4.data);
-            momentum_4[7].data = SIMD_FMA(grad_4[7].data, betta1_minus1_4.data, momentum_4[7].data);
-
-            variance_4[0].data = SIMD_MUL(variance_4[0].data, betta2_4.data);
-            variance_4[1].data = SIMD_MUL(variance_4[1].data, betta2_4.data);
-            variance_4[2].data = SIMD_MUL(variance_4[2].data, betta2_4.data);
-            variance_4[3].data = SIMD_MUL(variance_4[3].data, betta2_4.data);
-            variance_4[4].data = SIMD_MUL(variance_4[4].data, betta2_4.data);
-            variance_4[5].data = SIMD_MUL(variance_4[5].data, betta2_4.data);
-            variance_4[6].data = SIMD_MUL(variance_4[6].data, betta2_4.data);
-            variance_4[7].data = SIMD_MUL(variance_4[7].data, betta2_4.data);
-            grad_4[0].data = SIMD_MUL(grad_4[0].data, grad_4[0].data);
-            grad_4[1].data = SIMD_MUL(grad_4[1].data, grad_4[1].data);
-            grad_4[2].data = SIMD_MUL(grad_4[2].data, grad_4[2].data);
-            grad_4[3].data = SIMD_MUL(grad_4[3].data, grad_4[3].data);
-            grad_4[4].data = SIMD_MUL(grad_4[4].data, grad_4[4].data);
-            grad_4[5].data = SIMD_MUL(grad_4[5].data, grad_4[5].data);
-            grad_4[6].data = SIMD_MUL(grad_4[6].data, grad_4[6].data);
-            grad_4[7].data = SIMD_MUL(grad_4[7].data, grad_4[7].data);
-            variance_4[0].data = SIMD_FMA(grad_4[0].data, betta2_minus1_4.data, variance_4[0].data);
-            variance_4[1].data = SIMD_FMA(grad_4[1].data, betta2_minus1_4.data, variance_4[1].data);
-            variance_4[2].data = SIMD_FMA(grad_4[2].data, betta2_minus1_4.data, variance_4[2].data);
-            variance_4[3].data = SIMD_FMA(grad_4[3].data, betta2_minus1_4.data, variance_4[3].data);
-            variance_4[4].data = SIMD_FMA(grad_4[4].data, betta2_minus1_4.data, variance_4[4].data);
-            variance_4[5].data = SIMD_FMA(grad_4[5].data, betta2_minus1_4.data, variance_4[5].data);
-            variance_4[6].data = SIMD_FMA(grad_4[6].data, betta2_minus1_4.data, variance_4[6].data);
-            variance_4[7].data = SIMD_FMA(grad_4[7].data, betta2_minus1_4.data, variance_4[7].data);
-
-            grad_4[0].data = SIMD_SQRT(variance_4[0].data);
-            grad_4[1].data = SIMD_SQRT(variance_4[1].data);
-            grad_4[2].data = SIMD_SQRT(variance_4[2].data);
-            grad_4[3].data = SIMD_SQRT(variance_4[3].data);
-            grad_4[4].data = SIMD_SQRT(variance_4[4].data);
-            grad_4[5].data = SIMD_SQRT(variance_4[5].data);
-            grad_4[6].data = SIMD_SQRT(variance_4[6].data);
-            grad_4[7].data = SIMD_SQRT(variance_4[7].data);
-
-            grad_4[0].data = SIMD_FMA(grad_4[0].data, bias2_sqrt.data, eps_4.data);
-            grad_4[1].data = SIMD_FMA(grad_4[1].data, bias2_sqrt.data, eps_4.data);
-            grad_4[2].data = SIMD_FMA(grad_4[2].data, bias2_sqrt.data, eps_4.data);
-            grad_4[3].data = SIMD_FMA(grad_4[3].data, bias2_sqrt.data, eps_4.data);
-            grad_4[4].data = SIMD_FMA(grad_4[4].data, bias2_sqrt.data, eps_4.data);
-            grad_4[5].data = SIMD_FMA(grad_4[5].data, bias2_sqrt.data, eps_4.data);
-            grad_4[6].data = SIMD_FMA(grad_4[6].data, bias2_sqrt.data, eps_4.data);
-            grad_4[7].data = SIMD_FMA(grad_4[7].data, bias2_sqrt.data, eps_4.data);
-            grad_4[0].data = SIMD_DIV(momentum_4[0].data, grad_4[0].data);
-            grad_4[1].data = SIMD_DIV(momentum_4[1].data, grad_4[1].data);
-            grad_4[2].data = SIMD_DIV(momentum_4[2].data, grad_4[2].data);
-            grad_4[3].data = SIMD_DIV(momentum_4[3].data, grad_4[3].data);
-            grad_4[4].data = SIMD_DIV(momentum_4[4].data, grad_4[4].data);
-            grad_4[5].data = SIMD_DIV(momentum_4[5].data, grad_4[5].data);
-            grad_4[6].data = SIMD_DIV(momentum_4[6].data, grad_4[6].data);
-            grad_4[7].data = SIMD_DIV(momentum_4[7].data, grad_4[7].data);
-
-            param_4[0].data = SIMD_FMA(grad_4[0].data, step_size_4.data, param_4[0].data);
-            param_4[1].data = SIMD_FMA(grad_4[1].data, step_size_4.data, param_4[1].data);
-            param_4[2].data = SIMD_FMA(grad_4[2].data, step_size_4.data, param_4[2].data);
-            param_4[3].data = SIMD_FMA(grad_4[3].data, step_size_4.data, param_4[3].data);
-            param_4[4].data = SIMD_FMA(grad_4[4].data, step_size_4.data, param_4[4].data);
-            param_4[5].data = SIMD_FMA(grad_4[5].data, step_size_4.data, param_4[5].data);
-            param_4[6].data = SIMD_FMA(grad_4[6].data, step_size_4.data, param_4[6].data);
-            param_4[7].data = SIMD_FMA(grad_4[7].data, step_size_4.data, param_4[7].data);
-
-            SIMD_STORE(_params + i, param_4[0].data);
-            SIMD_STORE(_params + i + SIMD_WIDTH, param_4[1].data);
-            SIMD_STORE(_params + i + (SIMD_WIDTH << 1), param_4[2].data);
-            SIMD_STORE(_params + i + SIMD_WIDTH * 3, param_4[3].data);
-            SIMD_STORE(_params + i + (SIMD_WIDTH << 2), param_4[4].data);
-            SIMD_STORE(_params + i + SIMD_WIDTH * 5, param_4[5].data);
-            SIMD_STORE(_params + i + SIMD_WIDTH * 6, param_4[6].data);
-            SIMD_STORE(_params + i + SIMD_WIDTH * 7, param_4[7].data);
-
-            if (dev_params) {
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t), param_4[0].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH, param_4[1].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + (SIMD_WIDTH << 1),
-                           param_4[2].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH * 3, param_4[3].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + (SIMD_WIDTH << 2),
-                           param_4[4].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH * 5, param_4[5].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH * 6, param_4[6].data);
-                SIMD_STORE(_doubled_buffer[_buf_index] + (i - t) + SIMD_WIDTH * 7, param_4[7].data);
-            }
-
-            SIMD_STORE(_exp_avg + i, momentum_4[0].data);
-            SIMD_STORE(_exp_avg + i + SIMD_WIDTH, momentum_4[1].data);
-            SIMD_STORE(_exp_avg + i + (SIMD_WIDTH << 1), momentum_4[2].data);
-            SIMD_STORE(_exp_avg + i + SIMD_WIDTH * 3, momentum_4[3].data);
-            SIMD_STORE(_exp_avg + i + (SIMD_WIDTH << 2), momentum_4[4].data);
-            SIMD_STORE(_exp_avg + i + SIMD_WIDTH * 5, momentum_4[5].data);
-            SIMD_STORE(_exp_avg + i + SIMD_WIDTH * 6, momentum_4[6].data);
-            SIMD_STORE(_exp_avg + i + SIMD_WIDTH * 7, momentum_4[7].data);
-
-            SIMD_STORE(_exp_avg_sq + i, variance_4[0].data);
-            SIMD_STORE(_exp_avg_sq + i + SIMD_WIDTH, variance_4[1].data);
-            SIMD_STORE(_exp_avg_sq + i + (SIMD_WIDTH << 1), variance_4[2].data);
-            SIMD_STORE(_exp_avg_sq + i + SIMD_WIDTH * 3, variance_4[3].data);
-            SIMD_STORE(_exp_avg_sq + i + (SIMD_WIDTH << 2), variance_4[4].data);
-            SIMD_STORE(_exp_avg_sq + i + SIMD_WIDTH * 5, variance_4[5].data);
-            SIMD_STORE(_exp_avg_sq + i + SIMD_WIDTH * 6, variance_4[6].data);
-            SIMD_STORE(_exp_avg_sq + i + SIMD_WIDTH * 7, variance_4[7].data);
-        }
-        if (dev_params) {
-            launch_param_update(_doubled_buffer[_buf_index],
-                                dev_params + t,
-                                copy_size,
-                                Context::Instance().GetCurrentStream());
-            _buf_index = !_buf_index;
-        }
-    }
-#endif
+    size_t rounded_size =
+        Step_AVX<8, WeightDecay>(_params, grads, _exp_avg, _exp_avg_sq, _param_size, dev_params);
     if (_param_size > rounded_size)
-        Step_4((_params + rounded_size),
-               (grads + rounded_size),
-               (_exp_avg + rounded_size),
-               (_exp_avg_sq + rounded_size),
-               (_param_size - rounded_size),
-               (dev_params != nullptr ? (dev_params + rounded_size) : dev_params));
+        Step_4<WeightDecay>((_params + rounded_size),
+                            (grads + rounded_size),
+                            (_exp_avg + rounded_size),
+                            (_exp_avg_sq + rounded_size),
+                            (_param_size - rounded_size),
+                            (dev_params != nullptr ? (dev_params + rounded_size) : dev_params));
+}
+
+// The momentum is fp32 unless the optimizer keeps low-precision state, in
+// which case it arrives as a bfloat16 tensor and is handed on as raw 16-bit
+// words. The variance is always fp32.
+static void step_tensor(Adam_Optimizer* opt,
+                        torch::Tensor& params,
+                        torch::Tensor& grads,
+                        torch::Tensor& exp_avg,
+                        torch::Tensor& exp_avg_sq,
+                        __half* dev_params = nullptr)
+{
+    AT_ASSERTM(exp_avg_sq.scalar_type() == at::kFloat, "exp_avg_sq must be fp32");
+    if (exp_avg.scalar_type() == at::kBFloat16)
+        opt->Step_8((float*)params.data_ptr(),
+                    (float*)grads.data_ptr(),
+                    (uint16_t*)exp_avg.data_ptr(),
+                    (float*)exp_avg_sq.data_ptr(),
+                    params.numel(),
+                    dev_params);
+    else
+        opt->Step_8((float*)params.data_ptr(),
+                    (float*)grads.data_ptr(),
+                    (float*)exp_avg.data_ptr(),
+                    (float*)exp_avg_sq.data_ptr(),
+                    params.numel(),
+                    dev_params);
 }
 
 int ds_adam_step(int optimizer_id,
+                 float step_size,
+                 float bias_correction2,
+                 float betta1,
+                 float betta2,
+                 float eps,
+                 float weight_decay,
                  torch::Tensor& params,
                  torch::Tensor& grads,
                  torch::Tensor& exp_avg,
@@ -576,20 +324,22 @@ int ds_adam_step(int optimizer_id,
     auto exp_avg_c = exp_avg.contiguous();
     auto exp_avg_sq_c = exp_avg_sq.contiguous();
 
-    float* params_ptr = (float*)params_c.data_ptr();
-    float* grads_ptr = (float*)grads_c.data_ptr();
-    float* exp_avg_ptr = (float*)exp_avg_c.data_ptr();
-    float* exp_avg_sq_ptr = (float*)exp_avg_sq_c.data_ptr();
-
     std::shared_ptr<Adam_Optimizer> opt =
         std::static_pointer_cast<Adam_Optimizer>(s_optimizers[optimizer_id]);
-    opt->IncrementStep();
-    opt->Step_8(params_ptr, grads_ptr, exp_avg_ptr, exp_avg_sq_ptr, params_c.size(0));
+    opt->SetStepScalars(step_size, bias_correction2, betta1, betta2, eps, weight_decay);
+    step_tensor(opt.get(), params_c, grads_c, exp_avg_c, exp_avg_sq_c);
 
     return 0;
 }
 
+#if defined(__ENABLE_CUDA__)
 int ds_adam_step_plus_copy(int optimizer_id,
+                           float step_size,
+                           float bias_correction2,
+                           float betta1,
+                           float betta2,
+                           float eps,
+                           float weight_decay,
                            torch::Tensor& params,
                            torch::Tensor& grads,
                            torch::Tensor& exp_avg,
@@ -602,26 +352,106 @@ int ds_adam_step_plus_copy(int optimizer_id,
     auto exp_avg_sq_c = exp_avg_sq.contiguous();
     auto grads_c = grads.contiguous();
 
-    float* params_ptr = (float*)params_c.data_ptr();
-    float* grads_ptr = (float*)grads_c.data_ptr();
     __half* gpu_params_ptr = (__half*)gpu_params_c.data_ptr();
-    float* exp_avg_ptr = (float*)exp_avg_c.data_ptr();
-    float* exp_avg_sq_ptr = (float*)exp_avg_sq_c.data_ptr();
 
     std::shared_ptr<Adam_Optimizer> opt =
         std::static_pointer_cast<Adam_Optimizer>(s_optimizers[optimizer_id]);
-    opt->IncrementStep();
-    opt->Step_8(
-        params_ptr, grads_ptr, exp_avg_ptr, exp_avg_sq_ptr, params_c.size(0), gpu_params_ptr);
+    opt->SetStepScalars(step_size, bias_correction2, betta1, betta2, eps, weight_decay);
+    step_tensor(opt.get(), params_c, grads_c, exp_avg_c, exp_avg_sq_c, gpu_params_ptr);
 
     return 0;
 }
+#endif
+
+int ds_adam_step_multi(int optimizer_id,
+                       float step_size,
+                       float bias_correction2,
+                       float betta1,
+                       float betta2,
+                       float eps,
+                       float weight_decay,
+                       std::vector<torch::Tensor>& params,
+                       std::vector<torch::Tensor>& grads,
+                       std::vector<torch::Tensor>& exp_avg,
+                       std::vector<torch::Tensor>& exp_avg_sq)
+{
+    size_t num_tensors = params.size();
+    std::vector<torch::Tensor> params_c(num_tensors);
+    std::vector<torch::Tensor> grads_c(num_tensors);
+    std::vector<torch::Tensor> exp_avg_c(num_tensors);
+    std::vector<torch::Tensor> exp_avg_sq_c(num_tensors);
+    std::vector<size_t> small_tensors;
+
+    std::shared_ptr<Adam_Optimizer> opt =
+        std::static_pointer_cast<Adam_Optimizer>(s_optimizers[optimizer_id]);
+    opt->SetStepScalars(step_size, bias_correction2, betta1, betta2, eps, weight_decay);
+
+    for (size_t i = 0; i < num_tensors; i++) {
+        params_c[i] = params[i].contiguous();
+        grads_c[i] = grads[i].contiguous();
+        exp_avg_c[i] = exp_avg[i].contiguous();
+        exp_avg_sq_c[i] = exp_avg_sq[i].contiguous();
+
+        if (params_c[i].numel() < MULTI_TENSOR_THRESHOLD) {
+            small_tensors.push_back(i);
+            continue;
+        }
+        step_tensor(opt.get(), params_c[i], grads_c[i], exp_avg_c[i], exp_avg_sq_c[i]);
+    }
+
+    // Each small tensor is updated by a single thread; the parallel regions
+    // inside Step_8 are nested here and therefore run serially.
+#pragma omp parallel for schedule(dynamic) num_threads(opt->GetNumThreads())
+    for (size_t j = 0; j < small_tensors.size(); j++) {
+        size_t i = small_tensors[j];
+        step_tensor(opt.get(), params_c[i], grads_c[i], exp_avg_c[i], exp_avg_sq_c[i]);
+    }
+
+    return 0;
+}
+
+#if defined(__ENABLE_CUDA__)
+std::string get_pci_bus_id(int device)
+{
+    char bus_id[32];
+    CUDA_CHECK(cudaDeviceGetPCIBusId(bus_id, sizeof(bus_id), device));
+    return std::string(bus_id);
+}
+#endif
+
+int bind_threads(std::vector<int>& cpus)
+{
+    cpu_set_t mask;
+    CPU_ZERO(&mask);
+    for (int cpu : cpus) CPU_SET(cpu, &mask);
+
+    // The calling thread joins the team as its thread 0; keep its own mask so
+    // the Python main thread, and every thread it spawns later, stays unpinned.
+    cpu_set_t caller_mask;
+    pthread_getaffinity_np(pthread_self(), sizeof(caller_mask), &caller_mask);
+
+    // Pin every member of the OpenMP team, including threads the runtime has
+    // already spawned, which would not pick up a later process-level mask.
+    int failures = 0;
+#pragma omp parallel reduction(+ : failures)
+    failures += (pthread_setaffinity_np(pthread_self(), sizeof(mask), &mask) != 0);
+
+    pthread_setaffinity_np(pthread_self(), sizeof(caller_mask), &caller_mask);
+    return failures;
+}
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
 {
     m.def("adam_update", &ds_adam_step, "DeepSpeed CPU Adam update (C++)");
+    m.def("adam_update_multi",
+          &ds_adam_step_multi,
+          "DeepSpeed CPU Adam update over a list of tensors (C++)");
+#if defined(__ENABLE_CUDA__)
     m.def("adam_update_copy",
           &ds_adam_step_plus_copy,
           "DeepSpeed CPU Adam update and param copy (C++)");
+    m.def("get_pci_bus_id", &get_pci_bus_id, "PCI bus id of a CUDA device (C++)");
+#endif
     m.def("create_adam", &create_adam_optimizer, "DeepSpeed CPU Adam (C++)");
+    m.def("bind_threads", &bind_threads, "Bind the OpenMP threads to a set of CPUs (C++)");
 }
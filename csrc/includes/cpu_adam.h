@@ -1,11 +1,23 @@
 #pragma once
 
+#include <omp.h>
+#include <stdio.h>
+#include <cassert>
+#include <cstdint>
+#include <cstring>
+#if defined(__x86_64__)
 #include <cpuid.h>
+#include <x86intrin.h>
+#endif
+#if defined(__SVE__)
+#include <arm_sve.h>
+#endif
+
+// Without __ENABLE_CUDA__ (CPU-only or ROCm builds) the op is plain C++: the
+// fp16 device copy is not compiled in and __half is only used for its size.
+#if defined(__ENABLE_CUDA__)
 #include <cuda_fp16.h>
 #include <cuda_runtime_api.h>
-#include <stdio.h>
-#include <x86intrin.h>
-#include <cassert>
 #include "context.h"
 #include "cublas_v2.h"
 #include "cuda.h"
@@ -19,9 +31,23 @@
             assert(0);                                                                         \
         }                                                                                      \
     }
+#else
+#include <c10/util/Half.h>
+typedef c10::Half __half;
+#endif
 
 #define TILE (1024 * 1024 * 1024)
 
+// Software prefetch runs one 4KB page ahead of the SIMD loop, one request per
+// 64-byte cache line.
+#define CACHE_LINE_FLOATS (64 / sizeof(float))
+#define PREFETCH_DISTANCE (4096 / sizeof(float))
+#if defined(__x86_64__)
+#define SIMD_PREFETCH(x) _mm_prefetch((const char*)(x), _MM_HINT_T1)
+#else
+#define SIMD_PREFETCH(x) __builtin_prefetch((const void*)(x), 0, 2)
+#endif
+
 #if defined(__AVX512__)
 #define SIMD_STORE(a, d) _mm512_storeu_ps(a, d)
 #define SIMD_LOAD(x) _mm512_loadu_ps(x)
@@ -30,6 +56,8 @@
 #define SIMD_FMA(x, y, c) _mm512_fmadd_ps(x, y, c)
 #define SIMD_SQRT(x) _mm512_sqrt_ps(x)
 #define SIMD_DIV(x, y) _mm512_div_ps(x, y)
+#define SIMD_STORE_HALF(a, d) \
+    _mm256_storeu_si256((__m256i*)(a), _mm512_cvtps_ph(d, _MM_FROUND_TO_NEAREST_INT))
 #define SIMD_WIDTH 16
 #else
 #if defined(__AVX256__)
@@ -40,79 +68,260 @@
 #define SIMD_FMA(x, y, c) _mm256_fmadd_ps(x, y, c)
 #define SIMD_SQRT(x) _mm256_sqrt_ps(x)
 #define SIMD_DIV(x, y) _mm256_div_ps(x, y)
+#if defined(__F16C__)
+#define SIMD_STORE_HALF(a, d) \
+    _mm_storeu_si128((__m128i*)(a), _mm256_cvtps_ph(d, _MM_FROUND_TO_NEAREST_INT))
+#else
+#define SIMD_STORE_HALF(a, d)                                         \
+    {                                                                 \
+        float d_f[SIMD_WIDTH];                                        \
+        SIMD_STORE(d_f, d);                                           \
+        for (int h = 0; h < SIMD_WIDTH; h++) (a)[h] = (__half)d_f[h]; \
+    }
+#endif
 #define SIMD_WIDTH 8
+#else
+#if defined(__SVE__)
+// Compiled for one SVE vector length (-msve-vector-bits), which gives the
+// vectors a size so they fit AVX_Data and the unrolled register arrays.
+typedef svfloat32_t sve_float_t __attribute__((arm_sve_vector_bits(__ARM_FEATURE_SVE_BITS)));
+#define SIMD_STORE(a, d) svst1_f32(svptrue_b32(), a, d)
+#define SIMD_LOAD(x) svld1_f32(svptrue_b32(), x)
+#define SIMD_SET(x) svdup_n_f32(x)
+#define SIMD_MUL(x, y) svmul_f32_x(svptrue_b32(), x, y)
+#define SIMD_FMA(x, y, c) svmla_f32_x(svptrue_b32(), c, x, y)
+#define SIMD_SQRT(x) svsqrt_f32_x(svptrue_b32(), x)
+#define SIMD_DIV(x, y) svdiv_f32_x(svptrue_b32(), x, y)
+#define SIMD_STORE_HALF(a, d) \
+    svst1h_u32(               \
+        svptrue_b32(), (uint16_t*)(a), svreinterpret_u32_f16(svcvt_f16_f32_x(svptrue_b32(), d)))
+#define SIMD_WIDTH (__ARM_FEATURE_SVE_BITS / 32)
 #endif
 #endif
+#endif
+
+// Low-precision optimizer state keeps the momentum as the upper half of its
+// fp32 bit pattern (bfloat16), rounded to nearest even on store. The variance
+// always stays fp32: with beta2 close to 1 its per-step decay is below
+// bfloat16's resolution and would round away. The Step kernels are templated
+// on the momentum type and go through these overloads.
+inline float load_state(const float* x) { return *x; }
+inline float load_state(const uint16_t* x)
+{
+    uint32_t bits = (uint32_t)(*x) << 16;
+    float f;
+    memcpy(&f, &bits, sizeof(f));
+    return f;
+}
+inline void store_state(float* a, float d) { *a = d; }
+inline void store_state(uint16_t* a, float d)
+{
+    uint32_t bits;
+    memcpy(&bits, &d, sizeof(bits));
+    *a = (uint16_t)((bits + 0x7fff + ((bits >> 16) & 1)) >> 16);
+}
+
+#if defined(__AVX512__)
+inline __m512 simd_load_state(const float* x) { return SIMD_LOAD(x); }
+inline __m512 simd_load_state(const uint16_t* x)
+{
+    __m512i bits = _mm512_cvtepu16_epi32(_mm256_loadu_si256((const __m256i*)x));
+    return _mm512_castsi512_ps(_mm512_slli_epi32(bits, 16));
+}
+inline void simd_store_state(float* a, __m512 d) { SIMD_STORE(a, d); }
+inline void simd_store_state(uint16_t* a, __m512 d)
+{
+    __m512i bits = _mm512_castps_si512(d);
+    __m512i lsb = _mm512_and_si512(_mm512_srli_epi32(bits, 16), _mm512_set1_epi32(1));
+    bits = _mm512_add_epi32(bits, _mm512_add_epi32(lsb, _mm512_set1_epi32(0x7fff)));
+    _mm256_storeu_si256((__m256i*)a, _mm512_cvtepi32_epi16(_mm512_srli_epi32(bits, 16)));
+}
+#elif defined(__AVX256__)
+inline __m256 simd_load_state(const float* x) { return SIMD_LOAD(x); }
+inline __m256 simd_load_state(const uint16_t* x)
+{
+    __m256i bits = _mm256_cvtepu16_epi32(_mm_loadu_si128((const __m128i*)x));
+    return _mm256_castsi256_ps(_mm256_slli_epi32(bits, 16));
+}
+inline void simd_store_state(float* a, __m256 d) { SIMD_STORE(a, d); }
+inline void simd_store_state(uint16_t* a, __m256 d)
+{
+    __m256i bits = _mm256_castps_si256(d);
+    __m256i lsb = _mm256_and_si256(_mm256_srli_epi32(bits, 16), _mm256_set1_epi32(1));
+    bits = _mm256_add_epi32(bits, _mm256_add_epi32(lsb, _mm256_set1_epi32(0x7fff)));
+    // packus interleaves the two 128-bit lanes, the permute restores order
+    bits = _mm256_packus_epi32(_mm256_srli_epi32(bits, 16), _mm256_setzero_si256());
+    bits = _mm256_permute4x64_epi64(bits, 0xd8);
+    _mm_storeu_si128((__m128i*)a, _mm256_castsi256_si128(bits));
+}
+#elif defined(__SVE__)
+inline svfloat32_t simd_load_state(const float* x) { return SIMD_LOAD(x); }
+inline svfloat32_t simd_load_state(const uint16_t* x)
+{
+    svuint32_t bits = svld1uh_u32(svptrue_b32(), x);
+    return svreinterpret_f32_u32(svlsl_n_u32_x(svptrue_b32(), bits, 16));
+}
+inline void simd_store_state(float* a, svfloat32_t d) { SIMD_STORE(a, d); }
+inline void simd_store_state(uint16_t* a, svfloat32_t d)
+{
+    svbool_t pg = svptrue_b32();
+    svuint32_t bits = svreinterpret_u32_f32(d);
+    svuint32_t lsb = svand_n_u32_x(pg, svlsr_n_u32_x(pg, bits, 16), 1);
+    bits = svadd_u32_x(pg, bits, svadd_n_u32_x(pg, lsb, 0x7fff));
+    svst1h_u32(pg, a, svlsr_n_u32_x(pg, bits, 16));
+}
+#endif
 
 class Adam_Optimizer {
 public:
-    Adam_Optimizer(float alpha = 1e-3,
-                   float betta1 = 0.9,
-                   float betta2 = 0.999,
-                   float eps = 1e-8,
-                   float weight_decay = 0)
-        : _alpha(alpha),
-          _betta1(betta1),
-          _betta2(betta2),
-          _eps(eps),
-          _weight_decay(weight_decay),
-          _betta1_t(1.0),
-          _betta2_t(1.0),
-          _buf_index(false)
+    Adam_Optimizer(int num_threads = 0)
+        : _betta1(0.9),
+          _betta2(0.999),
+          _eps(1e-8),
+          _weight_decay(0),
+          _step_size(0),
+          _bias_correction2(1.0),
+          _buf_index(false),
+          _num_threads(num_threads > 0 ? num_threads : omp_get_max_threads())
     {
-        cudaMallocHost((void**)_doubled_buffer, TILE * sizeof(float));
-        cudaMallocHost((void**)(_doubled_buffer + 1), TILE * sizeof(float));
+#if defined(__ENABLE_CUDA__)
+        cudaMallocHost((void**)_doubled_buffer, TILE * sizeof(__half));
+        cudaMallocHost((void**)(_doubled_buffer + 1), TILE * sizeof(__half));
+        cudaEventCreateWithFlags(&_buf_events[0], cudaEventDisableTiming);
+        cudaEventCreateWithFlags(&_buf_events[1], cudaEventDisableTiming);
+#else
+        _doubled_buffer[0] = _doubled_buffer[1] = nullptr;
+#endif
     }
     ~Adam_Optimizer()
     {
+#if defined(__ENABLE_CUDA__)
         cudaFreeHost(_doubled_buffer[0]);
         cudaFreeHost(_doubled_buffer[1]);
+        cudaEventDestroy(_buf_events[0]);
+        cudaEventDestroy(_buf_events[1]);
+#endif
     }
+    // Selects the specialization once per call so the weight decay test is
+    // resolved at compile time instead of inside the SIMD loops.
+    template <typename StateT>
+    void Step_8(float* _params,
+                float* grads,
+                StateT* _exp_avg,
+                float* _exp_avg_sq,
+                size_t _param_size,
+                __half* dev_params = nullptr)
+    {
+        if (_weight_decay > 0)
+            Step_8<true>(_params, grads, _exp_avg, _exp_avg_sq, _param_size, dev_params);
+        else
+            Step_8<false>(_params, grads, _exp_avg, _exp_avg_sq, _param_size, dev_params);
+    }
+    template <bool WeightDecay, typename StateT>
     void Step(float* _params,
               float* grads,
-              float* _exp_avg,
+              StateT* _exp_avg,
               float* _exp_avg_sq,
               size_t param_size,
               __half* dev_param = nullptr);
+    template <bool WeightDecay, typename StateT>
     void Step_4(float* _params,
                 float* grads,
-                float* _exp_avg,
+                StateT* _exp_avg,
                 float* _exp_avg_sa,
                 size_t param_size,
                 __half* dev_param = nullptr);
+    template <bool WeightDecay, typename StateT>
     void Step_8(float* _params,
                 float* grads,
-                float* _exp_avg,
+                StateT* _exp_avg,
                 float* _exp_avg_sq,
                 size_t _param_size,
                 __half* dev_params = nullptr);
-    inline void IncrementStep()
+    // The caller computes step_size = lr / (1 - beta1^t) and
+    // bias_correction2 = sqrt(1 - beta2^t) once per optimizer step, and passes
+    // the param group's hyperparameters along since schedulers may change them.
+    inline int GetNumThreads() const { return _num_threads; }
+    inline void SetStepScalars(float step_size,
+                               float bias_correction2,
+                               float betta1,
+                               float betta2,
+                               float eps,
+                               float weight_decay)
     {
-        _betta1_t *= _betta1;
-        _betta2_t *= _betta2;
+        _step_size = -1 * step_size;
+        _bias_correction2 = 1 / bias_correction2;
+        _betta1 = betta1;
+        _betta2 = betta2;
+        _eps = eps;
+        _weight_decay = weight_decay;
     }
 
 private:
-#if defined(__AVX512__) or defined(__AVX256__)
+    template <int SPAN, bool WeightDecay, typename StateT>
+    size_t Step_AVX(float* _params,
+                    float* grads,
+                    StateT* _exp_avg,
+                    float* _exp_avg_sq,
+                    size_t _param_size,
+                    __half* dev_params);
+
+    // Ships the fp16 params staged in the current buffer to the device and
+    // switches to the other buffer. Builds without CUDA do not bind the copy,
+    // so dev_params is always null there.
+    inline void CopyParams(__half* dev_params, size_t size)
+    {
+#if defined(__ENABLE_CUDA__)
+        cudaStream_t stream = Context::Instance().GetCurrentStream();
+        cudaMemcpyAsync(dev_params,
+                        _doubled_buffer[_buf_index],
+                        size * sizeof(__half),
+                        cudaMemcpyHostToDevice,
+                        stream);
+        cudaEventRecord(_buf_events[_buf_index], stream);
+#endif
+        _buf_index = !_buf_index;
+    }
+
+    // Blocks until the copy last issued from the current buffer has drained,
+    // so staging the next tile cannot overwrite params still in flight.
+    inline void WaitParamsBuffer()
+    {
+#if defined(__ENABLE_CUDA__)
+        cudaEventSynchronize(_buf_events[_buf_index]);
+#endif
+    }
+
+#if defined(SIMD_WIDTH)
     union AVX_Data {
 #if defined(__AVX512__)
         __m512 data;
-#else
+#elif defined(__AVX256__)
         __m256 data;
+#else
+        sve_float_t data;
 #endif
         // float data_f[16];
     };
 #endif
 
-    float _alpha;
     float _betta1;
     float _betta2;
     float _eps;
     float _weight_decay;
 
-    float _betta1_t;
-    float _betta2_t;
+    float _step_size;
+    float _bias_correction2;
 
-    float* _doubled_buffer[2];
+    // fp16 staging buffers: params are converted on the CPU so that only half
+    // the bytes are written here and transferred to the device
+    __half* _doubled_buffer[2];
     bool _buf_index;
+#if defined(__ENABLE_CUDA__)
+    cudaEvent_t _buf_events[2];
+#endif
+
+    // size of the OpenMP team for the update loops; every rank on a node runs
+    // its own optimizer, so the team is capped at the rank's share of the CPUs
+    int _num_threads;
 };
@@ -251,5 +251,3 @@ void launch_fuse_transpose_bias_kernel(const T* inp,
                                        int rows,
                                        int cols,
                                        cudaStream_t stream);
-
-void launch_param_update(const float* input, __half* output, int size, cudaStream_t stream);
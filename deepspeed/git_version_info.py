@@ -12,3 +12,4 @@ except ModuleNotFoundError:
         'sparse-attn': False,
         'cpu-adam': False
     }
+    cpu_adam_isa = '[none]'
@@ -1,8 +1,91 @@
+import os
 import math
 import torch
 import importlib
+import inspect
+from deepspeed.utils import logger
 
-ds_opt_adam = None
+
+def _parse_cpu_list(cpu_list):
+    cpus = set()
+    for cpu_range in cpu_list.strip().split(','):
+        if not cpu_range:
+            continue
+        first, _, last = cpu_range.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def default_num_threads(cpus=None, num_ranks=None, mask=None):
+    """Size of the OpenMP team for one rank's CPU Adam update.
+
+    Every rank on a node drives its own optimizer, so the `num_ranks` ranks
+    sharing `cpus` each get an equal share of them; by default that is every
+    visible GPU's rank over the affinity `mask`. The mask defaults to the
+    calling thread's and must be taken before any binding of this optimizer,
+    since a mask narrower than the node means the launcher already gave this
+    rank its share, which is used as is. Returns 0, leaving the choice to the
+    OpenMP runtime, when OMP_NUM_THREADS is set or no GPU is visible.
+    """
+    if 'OMP_NUM_THREADS' in os.environ or not torch.cuda.is_available():
+        return 0
+    if mask is None:
+        mask = os.sched_getaffinity(0)
+    if len(mask) < os.cpu_count():
+        return len(cpus or mask)
+    if cpus is None:
+        cpus, num_ranks = mask, torch.cuda.device_count()
+    return max(1, len(cpus) // num_ranks)
+
+
+def _numa_node(ds_opt_adam, cuda_device_index):
+    bus_id = ds_opt_adam.get_pci_bus_id(cuda_device_index).lower()
+    domain, bus, device_function = bus_id.split(':')
+    pci_device = f'{int(domain, 16):04x}:{bus}:{device_function}'
+    try:
+        with open(f'/sys/bus/pci/devices/{pci_device}/numa_node', 'r') as fd:
+            return int(fd.read())
+    except (OSError, ValueError):
+        return -1
+
+
+def set_numa_affinity(cuda_device_index):
+    """Bind the CPU Adam threads to the NUMA node the given GPU is attached to.
+
+    Params, gradients and optimizer states are copied to and from host memory
+    near the GPU's PCIe root complex, so running the update on that node's
+    cores avoids crossing the socket interconnect. Returns the CPUs bound to
+    and the number of visible GPUs, one per rank, attached to the same node,
+    or (None, None) when the op was built without CUDA, the topology is not
+    exposed through sysfs or the node has no usable CPUs.
+    """
+    ds_opt_adam = importlib.import_module('deepspeed.ops.adam.cpu_adam_op')
+    if not hasattr(ds_opt_adam, 'get_pci_bus_id'):
+        return None, None
+    numa_node = _numa_node(ds_opt_adam, cuda_device_index)
+    if numa_node < 0:
+        return None, None
+    try:
+        with open(f'/sys/devices/system/node/node{numa_node}/cpulist', 'r') as fd:
+            cpus = _parse_cpu_list(fd.read())
+    except (OSError, ValueError):
+        return None, None
+
+    cpus &= os.sched_getaffinity(0)
+    if len(cpus) == 0:
+        return None, None
+    # only the OpenMP worker threads are pinned, bind_threads restores the mask
+    # of the calling thread so the main thread and anything it spawns keep
+    # running wherever they were
+    ds_opt_adam.bind_threads(sorted(cpus))
+    logger.info(
+        f'CPU Adam bound to {len(cpus)} CPUs on NUMA node {numa_node} of cuda:{cuda_device_index}'
+    )
+    gpu_nodes = [
+        _numa_node(ds_opt_adam,
+                   index) for index in range(torch.cuda.device_count())
+    ]
+    return cpus, gpu_nodes.count(numa_node)
 
 
 class DeepSpeedCPUAdam(torch.optim.Optimizer):
@@ -16,7 +99,10 @@ class DeepSpeedCPUAdam(torch.optim.Optimizer):
                         0.999),
                  eps=1e-8,
                  weight_decay=0,
-                 amsgrad=False):
+                 amsgrad=False,
+                 force_cpu=False,
+                 use_low_precision_state=False,
+                 bind_numa=False):
 
         default_args = dict(lr=lr,
                             betas=betas,
@@ -28,15 +114,159 @@ class DeepSpeedCPUAdam(torch.optim.Optimizer):
         self.opt_id = DeepSpeedCPUAdam.optimizer_id
         DeepSpeedCPUAdam.optimizer_id = DeepSpeedCPUAdam.optimizer_id + 1
 
-        global ds_opt_adam
-        ds_opt_adam = importlib.import_module('deepspeed.ops.adam.cpu_adam_op')
-        ds_opt_adam.create_adam(self.opt_id, lr, betas[0], betas[1], eps, weight_decay)
+        # the op is compiled ahead of time by setup.py, there is no JIT fallback
+        try:
+            self.ds_opt_adam = importlib.import_module('deepspeed.ops.adam.cpu_adam_op')
+        except ImportError as err:
+            logger.error(
+                "Unable to import the CPU Adam extension, please reinstall DeepSpeed with DS_BUILD_CPU_ADAM=1."
+            )
+            raise err
+
+        # opt-in: the binding only pays off when the bulk of the params live in
+        # host memory, and it overrides whatever pinning the user set up. The
+        # team is sized afterwards from the CPUs it was bound to, but against
+        # the affinity mask as it was before binding
+        mask = os.sched_getaffinity(0)
+        cpus, num_ranks = None, None
+        if bind_numa and torch.cuda.is_available():
+            cpus, num_ranks = set_numa_affinity(torch.cuda.current_device())
+        # create_adam checks that this CPU supports the ISA the op was built for
+        try:
+            self.ds_opt_adam.create_adam(self.opt_id,
+                                         default_num_threads(cpus,
+                                                             num_ranks,
+                                                             mask))
+        except RuntimeError as err:
+            # version info written by an older setup.py has no cpu_adam_isa
+            from deepspeed import git_version_info
+            cpu_adam_isa = getattr(git_version_info, 'cpu_adam_isa', '[none]')
+            logger.error(
+                f"The CPU Adam extension was built with -march={cpu_adam_isa}, please reinstall DeepSpeed with DS_BUILD_CPU_ADAM=1 on this machine."
+            )
+            raise err
+
+        # parameters left on the GPU (no ZeRO-Offload) are updated in place by
+        # apex's fused CUDA Adam instead of the CPU kernel; ZeRO-Offload passes
+        # force_cpu since all of its partitions live in host memory
+        self.force_cpu = force_cpu
+
+        # a bfloat16 momentum cuts the host memory and bandwidth of the state
+        # by a quarter at the cost of an 8-bit mantissa. The variance stays
+        # fp32: at beta2=0.999 its per-step decay is below bfloat16's
+        # resolution, so it would never shrink, and squared gradients
+        # underflow fp16's exponent range
+        self.use_low_precision_state = use_low_precision_state
+        self.cuda_optimizers = {}
 
     def __setstate__(self, state):
         super(DeepSpeedCPUAdam, self).__setstate__(state)
         for group in self.param_groups:
             group.setdefault('amsgrad', False)
 
+    def _step_scalars(self, group, step):
+        # the hyperparameters are read from the group on every step, like the
+        # lr, so schedulers such as OneCycle's cycle_momentum take effect
+        beta1, beta2 = group['betas']
+        bias_correction1 = 1 - beta1**step
+        bias_correction2 = 1 - beta2**step
+        return (group['lr'] / bias_correction1,
+                math.sqrt(bias_correction2),
+                beta1,
+                beta2,
+                group['eps'],
+                group['weight_decay'])
+
+    def _init_group_state(self, group_id, group):
+        """Allocate the moments of every uninitialized parameter in a group.
+
+        The momentums and variances of a group are views into flat buffers, one
+        shared allocation unless the momentum is kept in bfloat16, which
+        batches what would otherwise be two allocations per parameter. Like
+        torch.optim, only parameters that have a gradient get state, so frozen
+        or unused ones do not hold moments in host memory.
+        """
+        params = [
+            p for p in group['params']
+            if len(self.state[p]) == 0 and p.grad is not None and not p.is_cuda
+        ]
+        numel = sum(p.numel() for p in params)
+        logger.debug('cpu_adam: init state group=%d params=%d numel=%d',
+                     group_id,
+                     len(params),
+                     numel)
+
+        dtype = params[0].dtype
+        if self.use_low_precision_state:
+            momentums = torch.zeros(numel, dtype=torch.bfloat16, device='cpu')
+            variances = torch.zeros(numel, dtype=dtype, device='cpu')
+        else:
+            workspace = torch.zeros(2 * numel, dtype=dtype, device='cpu')
+            momentums = workspace.narrow(0, 0, numel)
+            variances = workspace.narrow(0, numel, numel)
+
+        offset = 0
+        for p in params:
+            state = self.state[p]
+            state['step'] = 0
+            # gradient momentums
+            state['exp_avg'] = momentums.narrow(0, offset, p.numel()).view_as(p.data)
+            # gradient variances
+            state['exp_avg_sq'] = variances.narrow(0, offset, p.numel()).view_as(p.data)
+            offset += p.numel()
+
+    def load_state_dict(self, state_dict):
+        super(DeepSpeedCPUAdam, self).load_state_dict(state_dict)
+        # Optimizer.load_state_dict casts the state to the dtype of its param,
+        # which would silently widen bfloat16 momentums back to fp32
+        if self.use_low_precision_state:
+            for p, state in self.state.items():
+                if 'exp_avg' in state and not p.is_cuda:
+                    state['exp_avg'] = state['exp_avg'].to(torch.bfloat16)
+
+    def _cuda_step(self, group_id, group, params):
+        """Update GPU-resident parameters of a group with apex's FusedAdam.
+
+        The fused optimizer shares this optimizer's state so the moments of
+        CUDA parameters are saved and restored with the rest of state_dict.
+        FusedAdam counts steps in its own param group, which state_dict does not
+        save, so the count is kept in each parameter's state as on the CPU path
+        and seeded into the fused group before every step.
+        """
+        fused = self.cuda_optimizers.get(group_id)
+        if fused is None:
+            from apex.optimizers.fused_adam import FusedAdam
+            kwargs = {}
+            # the CPU kernel adds weight_decay * p to the gradient (L2), while
+            # FusedAdam defaults to decoupled AdamW decay
+            if 'adam_w_mode' in inspect.signature(FusedAdam.__init__).parameters:
+                kwargs['adam_w_mode'] = False
+            fused = FusedAdam(params,
+                              lr=group['lr'],
+                              betas=group['betas'],
+                              eps=group['eps'],
+                              weight_decay=group['weight_decay'],
+                              **kwargs)
+            self.cuda_optimizers[group_id] = fused
+
+        assert group['weight_decay'] == 0 or getattr(fused, 'adam_w_mode', 1) == 0, \
+            "DeepSpeedCPUAdam needs an apex FusedAdam with adam_w_mode to apply weight decay to CUDA parameters"
+
+        # load_state_dict replaces self.state, so hand the fused optimizer the
+        # current dict on every step
+        fused.state = self.state
+        fused_group = fused.param_groups[0]
+        fused_group['params'] = params
+        for key in ['lr', 'betas', 'eps', 'weight_decay']:
+            fused_group[key] = group[key]
+        # the state of a new param stays empty until FusedAdam creates its
+        # moments, so the count is only written back after the step
+        step = max(self.state[p].get('step', 0) for p in params)
+        fused_group['step'] = step
+        fused.step()
+        for p in params:
+            self.state[p]['step'] = step + 1
+
     @torch.no_grad()
     def step(self, closure=None, fp16_param_groups=None):
         loss = None
@@ -44,38 +274,66 @@ class DeepSpeedCPUAdam(torch.optim.Optimizer):
             with torch.enable_grad():
                 loss = closure()
 
+        ds_opt_adam = self.ds_opt_adam
+        # builds without CUDA have no fused fp16 copy, the params are updated in
+        # place and copied to their fp16 counterparts afterwards instead
+        adam_update_copy = getattr(ds_opt_adam, 'adam_update_copy', None)
         for group_id, group in enumerate(self.param_groups):
+            step_batches = {}
+            fp16_copies = []
+            cuda_params = []
             for param_id, p in enumerate(group['params']):
 
                 if p.grad is None:
                     continue
 
+                if p.is_cuda:
+                    assert not self.force_cpu, \
+                        "DeepSpeedCPUAdam with force_cpu=True requires parameters in host memory"
+                    cuda_params.append(p)
+                    continue
+
                 grad = p.grad.data
                 state = self.state[p]
                 # State initialization
                 if len(state) == 0:
-                    print(f'group {group_id} param {param_id} = {p.numel()}')
-                    state['step'] = 0
-                    # gradient momentums
-                    state['exp_avg'] = torch.zeros_like(p.data, device='cpu')
-                    # gradient variances
-                    state['exp_avg_sq'] = torch.zeros_like(p.data, device='cpu')
+                    self._init_group_state(group_id, group)
 
                 exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
                 state['step'] += 1
 
-                if fp16_param_groups is not None:
+                if fp16_param_groups is not None and adam_update_copy is not None:
                     p_fp16 = fp16_param_groups[group_id][param_id]
-                    ds_opt_adam.adam_update_copy(self.opt_id,
-                                                 p.data,
-                                                 grad,
-                                                 exp_avg,
-                                                 exp_avg_sq,
-                                                 p_fp16)
+                    adam_update_copy(self.opt_id,
+                                     *self._step_scalars(group,
+                                                         state['step']),
+                                     p.data,
+                                     grad,
+                                     exp_avg,
+                                     exp_avg_sq,
+                                     p_fp16)
                 else:
-                    ds_opt_adam.adam_update(self.opt_id,
-                                            p.data,
-                                            grad,
-                                            exp_avg,
-                                            exp_avg_sq)
+                    batch = step_batches.setdefault(state['step'], ([], [], [], []))
+                    for tensors, tensor in zip(batch, (p.data, grad, exp_avg, exp_avg_sq)):
+                        tensors.append(tensor)
+                    if fp16_param_groups is not None:
+                        fp16_copies.append((p, fp16_param_groups[group_id][param_id]))
+
+            # one native call per step count, normally once per group, shares
+            # the bias correction and amortizes the binding overhead over
+            # groups with many small tensors
+            for step, (params, grads, exp_avgs, exp_avg_sqs) in step_batches.items():
+                ds_opt_adam.adam_update_multi(self.opt_id,
+                                              *self._step_scalars(group,
+                                                                  step),
+                                              params,
+                                              grads,
+                                              exp_avgs,
+                                              exp_avg_sqs)
+
+            for p, p_fp16 in fp16_copies:
+                p_fp16.data.copy_(p.data)
+
+            if cuda_params:
+                self._cuda_step(group_id, group, cuda_params)
         return loss
@@ -556,7 +556,9 @@ class DeepSpeedEngine(Module):
                 optimizer = FusedAdam(model_parameters, **optimizer_parameters)
         elif self.optimizer_name() == DEEPSPEED_ADAM:
             from deepspeed.ops.adam import DeepSpeedCPUAdam
-            optimizer = DeepSpeedCPUAdam(model_parameters, **optimizer_parameters)
+            optimizer = DeepSpeedCPUAdam(model_parameters,
+                                         force_cpu=self.zero_cpu_offload(),
+                                         **optimizer_parameters)
         elif self.optimizer_name() == LAMB_OPTIMIZER:
             from deepspeed.ops.lamb import FusedLamb
             optimizer = FusedLamb(model_parameters, **optimizer_parameters)
@@ -10,11 +10,12 @@ The wheel will be located at: dist/*.whl
 
 import os
 import torch
+import platform
 import shutil
 import subprocess
 import warnings
 from setuptools import setup, find_packages
-from torch.utils.cpp_extension import CUDAExtension, BuildExtension, CppExtension
+from torch.utils.cpp_extension import CUDAExtension, BuildExtension, CppExtension, CUDA_HOME
 
 VERSION = "0.3.0"
 
@@ -25,24 +26,41 @@ def fetch_requirements(path):
 
 
 def available_vector_instructions():
+    """Return the set of lower-cased SIMD feature flags supported by the build host."""
     try:
         import cpufeature
+        return {
+            feature.lower()
+            for feature,
+            supported in cpufeature.CPUFeature.items() if supported is True
+        }
     except ImportError:
-        warnings.warn(
-            f'import cpufeature failed - CPU vector optimizations are not available for CPUAdam'
-        )
-        return {}
+        warnings.warn(f'import cpufeature failed - falling back to /proc/cpuinfo')
+    except Exception:
+        warnings.warn(f'cpufeature.CPUFeature failed - falling back to /proc/cpuinfo')
 
-    cpu_vector_instructions = {}
     try:
-        cpu_vector_instructions = cpufeature.CPUFeature
-    except _:
-        warnings.warn(
-            f'cpufeature.CPUFeature failed - CPU vector optimizations are not available for CPUAdam'
-        )
-        return {}
-
-    return cpu_vector_instructions
+        with open('/proc/cpuinfo', 'r') as fd:
+            for line in fd:
+                # x86 lists 'flags', aarch64 lists 'Features'
+                if line.startswith('flags') or line.startswith('Features'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+
+    warnings.warn(
+        f'unable to detect CPU features - CPU vector optimizations are not available for CPUAdam'
+    )
+    return set()
+
+
+def sve_vector_bits():
+    """Return the build host's default SVE vector length in bits, or 0 if unknown."""
+    try:
+        with open('/proc/sys/abi/sve_default_vector_length', 'r') as fd:
+            return int(fd.read()) * 8
+    except (OSError, ValueError):
+        return 0
 
 
 install_requires = fetch_requirements('requirements/requirements.txt')
@@ -128,12 +146,36 @@ if (TORCH_MAJOR > 1) or (TORCH_MAJOR == 1 and TORCH_MINOR > 4):
     version_ge_1_5 = ['-DVERSION_GE_1_5']
 version_dependent_macros = version_ge_1_1 + version_ge_1_3 + version_ge_1_5
 
+# avx512f is the foundation subset every AVX-512 CPU reports, so it is the
+# canary for the 512-bit kernel rather than any flag merely prefixed 'avx512'.
+# The kernel is compiled for a named ISA level instead of -march=native so a
+# wheel built on one node does not pick up extensions (and SIGILL) on another;
+# both x86 levels imply FMA and F16C. Selection is keyed purely on reported
+# capabilities, never on the CPU vendor, so AMD Zen hosts get the same kernel.
+# SVE kernels are fixed to the build host's vector length, which create_adam
+# checks against the running CPU.
 SIMD_WIDTH = ''
-if cpu_vector_instructions.get('AVX512f', False):
-    SIMD_WIDTH = '-D__AVX512__'
-elif cpu_vector_instructions.get('AVX2', False):
-    SIMD_WIDTH = '-D__AVX256__'
-print("SIMD_WIDTH = ", SIMD_WIDTH)
+SIMD_FLAGS = []
+CPU_ADAM_ISA = ''
+if platform.machine() == 'aarch64':
+    CPU_ADAM_ISA = 'armv8-a'
+    sve_bits = sve_vector_bits() if 'sve' in cpu_vector_instructions else 0
+    if sve_bits:
+        SIMD_WIDTH = '-D__SVE__'
+        CPU_ADAM_ISA = 'armv8.2-a+sve'
+        SIMD_FLAGS = [f'-msve-vector-bits={sve_bits}']
+elif platform.machine() == 'x86_64':
+    CPU_ADAM_ISA = 'x86-64'
+    if 'avx512f' in cpu_vector_instructions:
+        SIMD_WIDTH = '-D__AVX512__'
+        CPU_ADAM_ISA = 'skylake-avx512'
+    elif 'avx2' in cpu_vector_instructions:
+        SIMD_WIDTH = '-D__AVX256__'
+        CPU_ADAM_ISA = 'haswell'
+if CPU_ADAM_ISA:
+    SIMD_FLAGS.insert(0, f'-march={CPU_ADAM_ISA}')
+print(f"SIMD_WIDTH = {SIMD_WIDTH}, SIMD_FLAGS = {SIMD_FLAGS}, "
+      f"processor = {platform.processor() or 'unknown'}")
 
 ext_modules = []
 
@@ -156,40 +198,37 @@ if BUILD_MASK & DS_BUILD_LAMB:
 
 ## Adam ##
 if BUILD_MASK & DS_BUILD_CPU_ADAM:
-    ext_modules.append(
-        CUDAExtension(name='deepspeed.ops.adam.cpu_adam_op',
-                      sources=[
-                          'csrc/adam/cpu_adam.cpp',
-                          'csrc/adam/custom_cuda_kernel.cu',
-                      ],
-                      include_dirs=['csrc/includes',
-                                    '/usr/local/cuda/include'],
-                      extra_compile_args={
-                          'cxx': [
-                              '-O3',
-                              '-std=c++14',
-                              '-L/usr/local/cuda/lib64',
-                              '-lcudart',
-                              '-lcublas',
-                              '-g',
-                              '-Wno-reorder',
-                              '-march=native',
-                              '-fopenmp',
-                              SIMD_WIDTH
-                          ],
-                          'nvcc': [
-                              '-O3',
-                              '--use_fast_math',
-                              '-gencode',
-                              'arch=compute_61,code=compute_61',
-                              '-gencode',
-                              'arch=compute_70,code=compute_70',
-                              '-std=c++14',
-                              '-U__CUDA_NO_HALF_OPERATORS__',
-                              '-U__CUDA_NO_HALF_CONVERSIONS__',
-                              '-U__CUDA_NO_HALF2_OPERATORS__'
-                          ]
-                      }))
+    cpu_adam_cxx_args = [
+        '-O3',
+        '-std=c++14',
+        '-g',
+        '-Wno-reorder',
+        '-fopenmp',
+        SIMD_WIDTH
+    ] + SIMD_FLAGS
+    if CUDA_HOME is not None and getattr(torch.version, 'hip', None) is None:
+        # CUDAExtension adds the CUDA include and lib64 directories and links
+        # cudart itself; Context also creates cublas and curand handles, so
+        # both of those need to be linked here
+        ext_modules.append(
+            CUDAExtension(
+                name='deepspeed.ops.adam.cpu_adam_op',
+                sources=[
+                    'csrc/adam/cpu_adam.cpp',
+                ],
+                include_dirs=['csrc/includes'],
+                extra_compile_args={'cxx': cpu_adam_cxx_args + ['-D__ENABLE_CUDA__']},
+                extra_link_args=['-lcublas',
+                                 '-lcurand']))
+    else:
+        # CPU-only and ROCm builds: plain C++ without the fused fp16 device copy
+        ext_modules.append(
+            CppExtension(name='deepspeed.ops.adam.cpu_adam_op',
+                         sources=[
+                             'csrc/adam/cpu_adam.cpp',
+                         ],
+                         include_dirs=['csrc/includes'],
+                         extra_compile_args={'cxx': cpu_adam_cxx_args}))
 
 ## Transformer ##
 if BUILD_MASK & DS_BUILD_TRANSFORMER:
@@ -322,8 +361,11 @@ with open('deepspeed/git_version_info_installed.py', 'w') as fd:
     fd.write(f"git_hash='{git_hash}'\n")
     fd.write(f"git_branch='{git_branch}'\n")
     fd.write(f"installed_ops={install_ops}\n")
+    fd.write(f"cpu_adam_isa='{CPU_ADAM_ISA}'\n")
 
 print(f'install_requires={install_requires}')
+if install_ops[CPU_ADAM]:
+    print(f'cpu_adam_isa={CPU_ADAM_ISA}')
 
 setup(name='deepspeed',
       version=f"{VERSION}+{git_hash}",
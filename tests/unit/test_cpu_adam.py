@@ -1,10 +1,13 @@
 import argparse
+import os
 import torch
 
 import time
 import numpy as np
 import pytest
 import copy
+import importlib
+import types
 
 import deepspeed
 if not deepspeed.ops.__installed_ops__['cpu-adam']:
@@ -51,3 +54,311 @@ def test_cpu_adam_opt(model_size):
         optimizer1.step()
 
     check_equal(param, param1, atol=1e-2, verbose=True)
+
+
+@pytest.mark.parametrize('model_sizes',
+                         [
+                             ([64, 22, 127]),
+                             ([1048576, 55, 1024]),
+                         ]) # yapf: disable
+def test_cpu_adam_multi_param(model_sizes):
+    device = 'cpu'
+    rng_state = torch.get_rng_state()
+    params = [
+        torch.nn.Parameter(torch.randn(size,
+                                       device=device)) for size in model_sizes
+    ]
+    torch.set_rng_state(rng_state)
+    params1 = [
+        torch.nn.Parameter(torch.randn(size,
+                                       device=device)) for size in model_sizes
+    ]
+
+    optimizer1 = torch.optim.Adam(params1)
+    optimizer = DeepSpeedCPUAdam(params)
+
+    for i in range(10):
+        rng_state = torch.get_rng_state()
+        for param, size in zip(params, model_sizes):
+            param.grad = torch.randn(size, device=device)
+        torch.set_rng_state(rng_state)
+        for param1, size in zip(params1, model_sizes):
+            param1.grad = torch.randn(size, device=device)
+
+        optimizer.step()
+        optimizer1.step()
+
+    for param, param1 in zip(params, params1):
+        check_equal(param, param1, atol=1e-2, verbose=True)
+
+
+def test_cpu_adam_lr_update():
+    device = 'cpu'
+    model_size = 1024
+    rng_state = torch.get_rng_state()
+    param = torch.nn.Parameter(torch.randn(model_size, device=device))
+    torch.set_rng_state(rng_state)
+    param1 = torch.nn.Parameter(torch.randn(model_size, device=device))
+
+    optimizer1 = torch.optim.Adam([param1])
+    optimizer = DeepSpeedCPUAdam([param])
+
+    for i in range(10):
+        if i == 5:
+            for opt in [optimizer, optimizer1]:
+                for group in opt.param_groups:
+                    group['lr'] = 1e-2
+
+        rng_state = torch.get_rng_state()
+        param.grad = torch.randn(model_size, device=device)
+        torch.set_rng_state(rng_state)
+        param1.grad = torch.randn(model_size, device=device)
+
+        optimizer.step()
+        optimizer1.step()
+
+    check_equal(param, param1, atol=1e-2, verbose=True)
+
+
+def test_cpu_adam_group_hyperparams_update():
+    device = 'cpu'
+    model_size = 1024
+    rng_state = torch.get_rng_state()
+    param = torch.nn.Parameter(torch.randn(model_size, device=device))
+    torch.set_rng_state(rng_state)
+    param1 = torch.nn.Parameter(torch.randn(model_size, device=device))
+
+    optimizer1 = torch.optim.Adam([param1])
+    optimizer = DeepSpeedCPUAdam([param])
+
+    for i in range(10):
+        # schedulers such as OneCycle with cycle_momentum rewrite the betas
+        for opt in [optimizer, optimizer1]:
+            for group in opt.param_groups:
+                group['betas'] = (0.9 - 0.01 * i, 0.999 - 0.001 * i)
+                if i == 5:
+                    group['eps'] = 1e-6
+                    group['weight_decay'] = 0.01
+
+        rng_state = torch.get_rng_state()
+        param.grad = torch.randn(model_size, device=device)
+        torch.set_rng_state(rng_state)
+        param1.grad = torch.randn(model_size, device=device)
+
+        optimizer.step()
+        optimizer1.step()
+
+    check_equal(param, param1, atol=1e-2, verbose=True)
+    check_equal(optimizer.state[param]['exp_avg'],
+                optimizer1.state[param1]['exp_avg'],
+                atol=1e-5)
+
+
+@pytest.mark.parametrize('model_size',
+                         [
+                             (64),
+                             (127),
+                             (1048576),
+                         ]) # yapf: disable
+def test_cpu_adam_low_precision_state(model_size):
+    device = 'cpu'
+    rng_state = torch.get_rng_state()
+    param = torch.nn.Parameter(torch.randn(model_size, device=device))
+    torch.set_rng_state(rng_state)
+    param1 = torch.nn.Parameter(torch.randn(model_size, device=device))
+
+    optimizer1 = torch.optim.Adam([param1])
+    optimizer = DeepSpeedCPUAdam([param], use_low_precision_state=True)
+
+    for i in range(10):
+        rng_state = torch.get_rng_state()
+        param.grad = torch.randn(model_size, device=device)
+        torch.set_rng_state(rng_state)
+        param1.grad = torch.randn(model_size, device=device)
+
+        optimizer.step()
+        optimizer1.step()
+
+    assert optimizer.state[param]['exp_avg'].dtype == torch.bfloat16
+    check_equal(param, param1, atol=1e-2, verbose=True)
+
+
+def test_cpu_adam_low_precision_state_decay():
+    # the variance must keep decaying once gradients shrink, which a bfloat16
+    # variance at beta2=0.999 does not
+    device = 'cpu'
+    model_size = 1024
+    param = torch.nn.Parameter(torch.ones(model_size, device=device))
+    param1 = torch.nn.Parameter(torch.ones(model_size, device=device))
+
+    optimizer1 = torch.optim.Adam([param1])
+    optimizer = DeepSpeedCPUAdam([param], use_low_precision_state=True)
+
+    for i in range(600):
+        scale = 1.0 if i < 100 else 0.01
+        param.grad = torch.full((model_size, ), scale, device=device)
+        param1.grad = torch.full((model_size, ), scale, device=device)
+
+        optimizer.step()
+        optimizer1.step()
+
+    check_equal(optimizer.state[param]['exp_avg_sq'],
+                optimizer1.state[param1]['exp_avg_sq'],
+                atol=1e-5)
+    check_equal(param, param1, atol=1e-2)
+
+
+def test_cpu_adam_low_precision_state_load():
+    model_size = 64
+    param = torch.nn.Parameter(torch.randn(model_size))
+    optimizer = DeepSpeedCPUAdam([param], use_low_precision_state=True)
+    param.grad = torch.randn(model_size)
+    optimizer.step()
+
+    optimizer.load_state_dict(optimizer.state_dict())
+
+    assert optimizer.state[param]['exp_avg'].dtype == torch.bfloat16
+    assert optimizer.state[param]['exp_avg_sq'].dtype == torch.float32
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+def test_cpu_adam_cuda_params():
+    pytest.importorskip('apex.optimizers')
+    model_size = 1024
+    rng_state = torch.get_rng_state()
+    params = [
+        torch.nn.Parameter(torch.randn(model_size)),
+        torch.nn.Parameter(torch.randn(model_size).cuda())
+    ]
+    torch.set_rng_state(rng_state)
+    params1 = [torch.nn.Parameter(torch.randn(model_size)) for _ in range(2)]
+
+    optimizer1 = torch.optim.Adam(params1, weight_decay=0.01)
+    optimizer = DeepSpeedCPUAdam(params, weight_decay=0.01)
+
+    for i in range(10):
+        if i == 3:
+            # the fused optimizer must follow the state dict load_state_dict installs
+            optimizer.load_state_dict(optimizer.state_dict())
+        if i == 6:
+            # resuming into a new optimizer must keep the step count, which
+            # FusedAdam itself only tracks in its own param group
+            state_dict = optimizer.state_dict()
+            optimizer = DeepSpeedCPUAdam(params, weight_decay=0.01)
+            optimizer.load_state_dict(state_dict)
+
+        rng_state = torch.get_rng_state()
+        for param in params:
+            param.grad = torch.randn(model_size).to(param.device)
+        torch.set_rng_state(rng_state)
+        for param1 in params1:
+            param1.grad = torch.randn(model_size)
+
+        optimizer.step()
+        optimizer1.step()
+
+    for param, param1 in zip(params, params1):
+        assert optimizer.state[param]['step'] == 10
+        check_equal(param.cpu(), param1, atol=1e-4, verbose=True)
+        check_equal(optimizer.state[param]['exp_avg'].cpu(),
+                    optimizer1.state[param1]['exp_avg'],
+                    atol=1e-4)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+def test_cpu_adam_force_cpu():
+    param = torch.nn.Parameter(torch.randn(64).cuda())
+    optimizer = DeepSpeedCPUAdam([param], force_cpu=True)
+    param.grad = torch.randn(64).cuda()
+    with pytest.raises(AssertionError):
+        optimizer.step()
+
+
+@pytest.mark.parametrize('cpu_list,cpus',
+                         [
+                             ('0-3\n', {0, 1, 2, 3}),
+                             ('0-1,4,6-7', {0, 1, 4, 6, 7}),
+                             ('5', {5}),
+                             ('\n', set()),
+                         ]) # yapf: disable
+def test_parse_cpu_list(cpu_list, cpus):
+    from deepspeed.ops.adam.cpu_adam import _parse_cpu_list
+    assert _parse_cpu_list(cpu_list) == cpus
+
+
+def test_default_num_threads(monkeypatch):
+    from deepspeed.ops.adam.cpu_adam import default_num_threads
+    monkeypatch.delenv('OMP_NUM_THREADS', raising=False)
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: True)
+    monkeypatch.setattr(torch.cuda, 'device_count', lambda: 4)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 64)
+
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(64)))
+    assert default_num_threads() == 16
+    assert default_num_threads(set(range(32)), 2) == 16
+
+    # the launcher already pinned each rank to its share of the node
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: set(range(16)))
+    assert default_num_threads() == 16
+    assert default_num_threads(set(range(8)), 2) == 8
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+@pytest.mark.parametrize('fused_copy', [True, False])
+def test_cpu_adam_fp16_copy(fused_copy):
+    # the sizes leave tails for the 8-, 4- and 1-way loops and the scalar loop
+    model_sizes = [1048576 + 55, 22]
+    params = [torch.nn.Parameter(torch.randn(size)) for size in model_sizes]
+    params_fp16 = [p.detach().half().cuda() for p in params]
+
+    optimizer = DeepSpeedCPUAdam(params)
+    if not fused_copy:
+        # hide adam_update_copy to take the path of builds without CUDA
+        ds_opt_adam = optimizer.ds_opt_adam
+        optimizer.ds_opt_adam = types.SimpleNamespace(
+            adam_update_multi=ds_opt_adam.adam_update_multi)
+
+    for i in range(3):
+        for param, size in zip(params, model_sizes):
+            param.grad = torch.randn(size)
+        optimizer.step(fp16_param_groups=[params_fp16])
+        torch.cuda.synchronize()
+
+        for param, param_fp16 in zip(params, params_fp16):
+            assert torch.equal(param_fp16.cpu(), param.data.half())
+
+
+def test_bind_threads_keeps_caller_mask():
+    ds_opt_adam = importlib.import_module('deepspeed.ops.adam.cpu_adam_op')
+    mask = os.sched_getaffinity(0)
+    assert ds_opt_adam.bind_threads([min(mask)]) == 0
+    assert os.sched_getaffinity(0) == mask
+    ds_opt_adam.bind_threads(sorted(mask))
+
+
+def test_cpu_adam_frozen_params_have_no_state():
+    params = [torch.nn.Parameter(torch.randn(64)) for _ in range(2)]
+    optimizer = DeepSpeedCPUAdam(params)
+    params[0].grad = torch.randn(64)
+    optimizer.step()
+
+    assert len(optimizer.state[params[0]]) > 0
+    assert len(optimizer.state[params[1]]) == 0
+
+
+def test_default_num_threads_after_bind(monkeypatch):
+    from deepspeed.ops.adam.cpu_adam import default_num_threads
+    ds_opt_adam = importlib.import_module('deepspeed.ops.adam.cpu_adam_op')
+    monkeypatch.delenv('OMP_NUM_THREADS', raising=False)
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: True)
+    monkeypatch.setattr(torch.cuda, 'device_count', lambda: 2)
+
+    mask = os.sched_getaffinity(0)
+    monkeypatch.setattr(os, 'cpu_count', lambda: len(mask))
+    # binding to part of the node must not read as a launcher-pinned rank
+    ds_opt_adam.bind_threads([min(mask)])
+    try:
+        assert default_num_threads() == max(1, len(mask) // 2)
+        assert default_num_threads(mask=mask) == max(1, len(mask) // 2)
+    finally:
+        ds_opt_adam.bind_threads(sorted(mask))